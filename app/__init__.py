@@ -1,8 +1,8 @@
 from flask import Flask
 from flask_login import LoginManager
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 
+from app.db_routing import RoutingSQLAlchemy, init_statement_timeouts
 from config import Config
 
 
@@ -10,8 +10,9 @@ from config import Config
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# database init
-db = SQLAlchemy(app)
+# database init (reads of statistics can be routed to a replica, see app/db_routing.py)
+db = RoutingSQLAlchemy(app)
+init_statement_timeouts(app, db)
 
 
 def session_add(obj):
@@ -44,6 +45,10 @@ migrate = Migrate(app, db)
 login = LoginManager(app)
 login.login_view = 'auth.login'
 
+# performance accounting (enabled by PERFORMANCE_MONITORING in config.py)
+from app.performance import init_performance
+init_performance(app)
+
 # Import module using its blueprint
 from app.mod_stats.controllers import mod_stats as statistics_module
 from app.mod_auth.controllers import mod_auth as auth_module
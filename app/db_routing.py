@@ -0,0 +1,196 @@
+"""
+Database connection settings: routing of reads to a replica database, pool options and statement timeouts
+
+Replica is one of SQLALCHEMY_BINDS (config.py), statistics pages and StatsDataExtractor read from
+STATS_READ_BIND, everything else (admin panel, authentication, db_update.py ingest) uses the primary database.
+Writes (session flush) always go to the primary database.
+
+Replica is complete up to <now - replication lag>. Reports of periods ending after that point ("today")
+are read from the primary database when the lag is bigger than REPLICA_MAX_LAG.
+
+Pool options are SQLALCHEMY_POOL_* settings of Flask-SQLAlchemy plus SQLALCHEMY_POOL_PRE_PING.
+Statements of requests are limited by STATEMENT_TIMEOUTS of their blueprint (PostgreSQL SET LOCAL statement_timeout),
+db_update.py ingest is not limited.
+"""
+import contextlib
+import datetime
+import threading
+import time
+
+from flask import request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+
+
+# PostgreSQL 10+ standby: no lag if all received WAL is replayed, otherwise age of the last replayed transaction
+POSTGRES_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+# PostgreSQL error code of statement cancelled by statement_timeout
+QUERY_CANCELED_PGCODE = "57014"
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that reads from bind set in session.info["read_bind"] (see RoutingSQLAlchemy.read_from),
+    models with __bind_key__ and flushes keep their usual binds
+    """
+    def get_bind(self, mapper=None, clause=None):
+        read_bind = self.info.get("read_bind")
+
+        if read_bind is not None and not self._flushing:
+            has_bind_key = mapper is not None and getattr(mapper.mapped_table, "info", {}).get("bind_key")
+
+            if not has_bind_key:
+                return get_state(self.app).db.get_engine(self.app, bind=read_bind)
+
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension with RoutingSession, pool pre-ping, statement timeouts and replication lag checks"""
+    def __init__(self, *args, **kwargs):
+        # bind key: (time of check, lag in seconds or None)
+        self.replication_lags = {}
+        self.replication_lags_lock = threading.Lock()
+        SQLAlchemy.__init__(self, *args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        if info.drivername == "sqlite":
+            # SQLite files are opened on each use (NullPool), pool sizes do not apply
+            for option in ("pool_size", "max_overflow", "pool_timeout"):
+                options.pop(option, None)
+
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+
+        # connections dropped by database server or network are replaced before use
+        options["pool_pre_ping"] = app.config.get("SQLALCHEMY_POOL_PRE_PING", False)
+
+    def set_statement_timeout(self, milliseconds):
+        """
+        Limit time of each statement until the session is removed (end of request)
+        :param milliseconds: statement timeout, None for no limit
+        """
+        self.session.info["statement_timeout"] = milliseconds
+
+    def use_read_bind(self, bind_key):
+        """
+        Read from bind until the session is removed (end of request)
+        :param bind_key: key of SQLALCHEMY_BINDS, None for primary database
+        """
+        self.session.info["read_bind"] = bind_key
+
+    @contextlib.contextmanager
+    def read_from(self, bind_key):
+        """
+        Context manager, reads from bind inside the block
+        :param bind_key: key of SQLALCHEMY_BINDS, None for primary database
+        """
+        previous_bind = self.session.info.get("read_bind")
+        self.session.info["read_bind"] = bind_key
+
+        try:
+            yield
+        finally:
+            self.session.info["read_bind"] = previous_bind
+
+    def get_replication_lag(self, bind_key):
+        """
+        Replication lag of replica, checked at most once per REPLICA_LAG_CHECK_INTERVAL seconds
+        Only PostgreSQL standby servers are checked, other databases have no lag
+
+        :param bind_key: key of SQLALCHEMY_BINDS
+        :return: lag in seconds, None if replica is not available
+        """
+        app = self.get_app()
+
+        with self.replication_lags_lock:
+            checked_at, lag = self.replication_lags.get(bind_key, (None, None))
+            if checked_at is not None and time.time() - checked_at < app.config["REPLICA_LAG_CHECK_INTERVAL"]:
+                return lag
+
+        engine = self.get_engine(app, bind=bind_key)
+
+        try:
+            if engine.dialect.name == "postgresql":
+                lag = float(engine.execute(POSTGRES_LAG_QUERY).scalar() or 0)
+            else:
+                lag = 0
+        except Exception:
+            lag = None
+
+        with self.replication_lags_lock:
+            self.replication_lags[bind_key] = (time.time(), lag)
+
+        return lag
+
+    def get_stats_read_bind(self, end_time):
+        """
+        Choose database for statistics of a period
+        :param end_time: end of the period (datetime or "YYYY-MM-DD" string of custom periods)
+        :return: STATS_READ_BIND or None (primary database) if replica is not available or lags behind the period
+        """
+        app = self.get_app()
+        bind_key = app.config.get("STATS_READ_BIND")
+
+        if bind_key is None:
+            return None
+
+        lag = self.get_replication_lag(bind_key)
+
+        if lag is None:
+            return None
+
+        if lag <= app.config["REPLICA_MAX_LAG"]:
+            return bind_key
+
+        if isinstance(end_time, str):
+            try:
+                end_time = datetime.datetime.strptime(end_time[:10], "%Y-%m-%d")
+            except ValueError:
+                return None
+
+        # replica has all data of periods which ended before the last replayed transaction
+        if end_time is not None and end_time < datetime.datetime.utcnow() - datetime.timedelta(seconds=lag):
+            return bind_key
+
+        return None
+
+
+@event.listens_for(RoutingSession, "after_begin")
+def apply_statement_timeout(session, transaction, connection):
+    """
+    SET LOCAL lasts until the end of transaction, so pooled connections are not affected after the request,
+    it is applied to each connection (primary and replica) the session begins a transaction on
+    """
+    milliseconds = session.info.get("statement_timeout")
+
+    if milliseconds and connection.dialect.name == "postgresql":
+        connection.execute("SET LOCAL statement_timeout = %d" % milliseconds)
+
+
+def is_statement_timeout(error):
+    """
+    :param error: sqlalchemy.exc.OperationalError
+    :return: True if statement was cancelled by statement_timeout
+    """
+    return getattr(error.orig, "pgcode", None) == QUERY_CANCELED_PGCODE
+
+
+def init_statement_timeouts(app, db):
+    """
+    Apply STATEMENT_TIMEOUTS of app config to requests of each blueprint
+    :param app: Flask application
+    :param db: RoutingSQLAlchemy object
+    """
+    timeouts = app.config.get("STATEMENT_TIMEOUTS") or {}
+
+    @app.before_request
+    def set_request_statement_timeout():
+        db.set_statement_timeout(timeouts.get(request.blueprint))
@@ -1,7 +1,9 @@
-from flask import Blueprint, redirect, url_for, render_template
+from flask import Blueprint, redirect, url_for, render_template, request, current_app
 from flask_login import current_user
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
 
-from app import session_commit, session_add, session_delete
+from app import db, session_commit, session_add, session_delete
 from app.models import Organization, User
 from app.mod_admin.forms import OrgInfoForm, OrgCreateForm, UserCreateForm, UserInfoForm, EmailForm, PasswordForm
 
@@ -18,21 +20,63 @@ def check_authenticated_user():
         return redirect(url_for("auth.login"))
     else:
         if not current_user.is_admin:  # user is not admin
-            org_id = current_user.organizations[0].id
-            return redirect(url_for("stats.show_today", org_id=org_id))
+            return redirect(url_for("stats.show_today", org_id=current_user.default_org_id))
+
+
+def get_by_ids(model, ids):
+    """
+    Load objects selected in a form with one query
+    :param model: User or Organization
+    :param ids: list of IDs
+    :return: list of objects
+    """
+    if not ids:
+        return []
+
+    return model.query.filter(model.id.in_(ids)).all()
+
+
+def get_choices(*columns):
+    """
+    Choices of select multiple field, only the two columns are loaded (not whole objects)
+    :param columns: ID column and label column
+    :return: list of tuples (ID, label)
+    """
+    return db.session.query(*columns).order_by(columns[1]).all()
+
+
+def paginate_list(query, search_columns):
+    """
+    Filter list by "search" and return requested "page" (URL parameters), ADMIN_PAGE_SIZE rows per page
+    :param query: query of the list
+    :param search_columns: columns searched for the text (case insensitive)
+    :return: tuple (Pagination object, search text)
+    """
+    search = request.args.get("search", "").strip()
+    page = request.args.get("page", 1, type=int)
+
+    if search:
+        pattern = "%{}%".format(search)
+        query = query.filter(or_(*[column.ilike(pattern) for column in search_columns]))
+
+    pagination = query.paginate(page=page, per_page=current_app.config["ADMIN_PAGE_SIZE"], error_out=False)
+
+    return pagination, search
 
 
 @mod_admin.route("/", methods=["GET"])
 def show_panel():
-    users = User.query.all()
-    return render_template("admin_panel/list_users.html", users=users)
+    query = User.query.options(selectinload(User.organizations)).order_by(User.id)
+    pagination, search = paginate_list(query, [User.username, User.email])
+
+    return render_template("admin_panel/list_users.html", users=pagination.items, pagination=pagination,
+                           search=search)
 
 
 @mod_admin.route("/add_user", methods=["GET", "POST"])
 def add_user():
     form = UserCreateForm()
-    orgs = Organization.query.all()
-    form.organizations.choices = [(org.id, org.name) for org in orgs]
+    form.organizations.choices = get_choices(Organization.id, Organization.name)
 
     if form.validate_on_submit():
         user = User(username=form.username.data,
@@ -40,13 +84,7 @@ def add_user():
                     is_admin=form.is_admin.data,
                     )
         user.set_password(form.password.data)
-        orgs = []
-
-        for org_id in form.organizations.data:
-            org = Organization.query.filter_by(id=org_id).first()
-            orgs.append(org)
-
-        user.organizations = orgs
+        user.organizations = get_by_ids(Organization, form.organizations.data)
         session_add(user)
         session_commit()
 
@@ -59,19 +97,12 @@ def add_user():
 def change_userinfo(user_id):
     form = UserInfoForm()
     user = User.query.filter_by(id=user_id).first()
-    orgs = Organization.query.all()
-    form.organizations.choices = [(org.id, org.name) for org in orgs]
+    form.organizations.choices = get_choices(Organization.id, Organization.name)
 
     if form.validate_on_submit():
         user.username = form.username.data
         user.is_admin = form.is_admin.data
-        orgs = []
-
-        for org_id in form.organizations.data:
-            org = Organization.query.filter_by(id=org_id).first()
-            orgs.append(org)
-
-        user.organizations = orgs
+        user.organizations = get_by_ids(Organization, form.organizations.data)
         session_commit()
 
         return redirect(url_for("admin.show_panel"))
@@ -118,28 +149,22 @@ def delete_user(user_id):
 
 @mod_admin.route("/list_organizations", methods=["GET"])
 def list_organizations():
-    orgs = Organization.query.all()
+    query = Organization.query.options(selectinload(Organization.users)).order_by(Organization.id)
+    pagination, search = paginate_list(query, [Organization.name, Organization.data_dir])
 
-    return render_template("admin_panel/list_organizations.html", orgs=orgs)
+    return render_template("admin_panel/list_organizations.html", orgs=pagination.items, pagination=pagination,
+                           search=search)
 
 
 @mod_admin.route("/add_organization", methods=["GET", "POST"])
 def add_organization():
     form = OrgCreateForm()
-    users = User.query.all()
-    # empty_choice = [(0, " " * 10)]
-    form.users.choices = [(user.id, user.email) for user in users]
+    form.users.choices = get_choices(User.id, User.email)
 
     if form.validate_on_submit():
         org = Organization(name=form.name.data,
                            data_dir=form.data_dir.data)
-        users = []
-
-        for user_id in form.users.data:
-            user = User.query.filter_by(id=user_id).first()
-            users.append(user)
-
-        org.users = users
+        org.users = get_by_ids(User, form.users.data)
         session_add(org)
         session_commit()
 
@@ -151,20 +176,13 @@ def add_organization():
 @mod_admin.route("/edit_organization/<org_id>", methods=["GET", "POST"])
 def edit_organization(org_id):
     form = OrgInfoForm()
-    users = User.query.all()
-    form.users.choices = [(user.id, user.email) for user in users]
+    form.users.choices = get_choices(User.id, User.email)
     org = Organization.query.filter_by(id=org_id).first()
 
     if form.validate_on_submit():
         org.name = form.name.data
         org.data_dir = form.data_dir.data
-        users = []
-
-        for user_id in form.users.data:
-            user = User.query.filter_by(id=user_id).first()
-            users.append(user)
-
-        org.users = users
+        org.users = get_by_ids(User, form.users.data)
         session_commit()
 
         return redirect(url_for("admin.list_organizations"))
@@ -17,26 +17,13 @@ def login():
     If successful, statistics for current day is shown (/statistics/show_today)
     """
     if current_user.is_authenticated:
-        user = User.query.filter_by(email=current_user.email).first()
-
-        # change this
-        if user.organizations:
-            org_id = user.organizations[0].id
-        else:
-            org_id = 0
-        return redirect(url_for('stats.show_today', org_id=org_id))
+        return redirect(url_for('stats.show_today', org_id=current_user.default_org_id))
 
     form = LoginForm()
 
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
 
-        # change this
-        if user.organizations:
-            org_id = user.organizations[0].id
-        else:
-            org_id = 0
-
         if user is None or not user.check_password(form.password.data):
             form.password.errors.append("Email or password are incorrect.")
 
@@ -44,7 +31,7 @@ def login():
 
         login_user(user, remember=form.remember_me.data)
 
-        return redirect(url_for('stats.show_today', org_id=org_id))
+        return redirect(url_for('stats.show_today', org_id=user.default_org_id))
 
     return render_template('auth/login.html', title='Sign In', form=form)
 
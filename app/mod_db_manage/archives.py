@@ -0,0 +1,135 @@
+"""
+Reading Order and Master files straight from zip and tar (tar.gz) bundles, without extracting them.
+
+Members of an archive are listed by the organization directory index (see OrgIndex in utils.py)
+under virtual paths, as if the archive was extracted in place:
+<group directory>/<archive>.zip containing "Master Files/PLU.xml" gives <group directory>/Master Files/PLU.xml
+Virtual paths are keyed by member name, so processed files manifest skips members
+that were ingested already from another bundle or from extracted files.
+"""
+import hashlib
+import os
+import tarfile
+import time
+import zipfile
+
+from app.mod_db_manage.config import ARCHIVE_EXTENSIONS
+
+
+class ArchiveMember:
+    """File stored in an archive"""
+    __slots__ = ("name", "size", "mtime", "content_hash")
+
+    def __init__(self, name, size, mtime, content_hash):
+        """
+        :param name: member name, "/" separated path inside the archive
+        :param size: uncompressed size in bytes
+        :param mtime: modification time stored in the archive
+        :param content_hash: hash of member content (used by processed files manifest)
+        """
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.content_hash = content_hash
+
+
+def is_archive(filename):
+    """
+    :param filename: file name or path
+    :return: True if file is a supported archive (see ARCHIVE_EXTENSIONS)
+    """
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def list_zip_members(archive_path):
+    members = []
+
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if info.filename.endswith("/"):
+                continue
+
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            # CRC is stored in the archive, content does not have to be read
+            members.append(ArchiveMember(info.filename, info.file_size, mtime, "crc32:{:08x}".format(info.CRC)))
+
+    return members
+
+
+def list_tar_members(archive_path):
+    members = []
+
+    # compressed tar has no table of contents, it is read through anyway, so content is hashed on the way
+    with tarfile.open(archive_path, "r:*") as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+
+            file_hash = hashlib.md5()
+            f = archive.extractfile(info)
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                file_hash.update(chunk)
+
+            members.append(ArchiveMember(info.name, info.size, info.mtime, file_hash.hexdigest()))
+
+    return members
+
+
+def list_archive_members(archive_path):
+    """
+    Get files stored in an archive, directories are skipped
+    :param archive_path: path of zip or tar archive
+    :return: list of ArchiveMember objects in archive order
+    """
+    if zipfile.is_zipfile(archive_path):
+        return list_zip_members(archive_path)
+
+    return list_tar_members(archive_path)
+
+
+# (process ID, archive path): open ZipFile or TarFile
+# archives are not shared with forked processes, each process reads with its own file handle
+open_archives = {}
+
+
+def get_open_archive(archive_path):
+    key = (os.getpid(), archive_path)
+    archive = open_archives.get(key)
+
+    if archive is None:
+        if zipfile.is_zipfile(archive_path):
+            archive = zipfile.ZipFile(archive_path)
+        else:
+            archive = tarfile.open(archive_path, "r:*")
+        open_archives[key] = archive
+
+    return archive
+
+
+def open_archive_member(archive_path, member_name):
+    """
+    Open archive member as binary file-like object, content is decompressed while it is read
+    Archive stays open for next members, members of tar.gz are best read in archive order
+
+    :param archive_path: path of zip or tar archive
+    :param member_name: member name
+    :return: file-like object
+    """
+    archive = get_open_archive(archive_path)
+
+    if isinstance(archive, zipfile.ZipFile):
+        return archive.open(member_name)
+
+    return archive.extractfile(member_name)
+
+
+def close_archives(archive_paths=None):
+    """
+    Close archives opened by this process
+    :param archive_paths: paths of archives to close, all archives if None
+    """
+    pid = os.getpid()
+
+    for key in list(open_archives):
+        if key[0] == pid and (archive_paths is None or key[1] in archive_paths):
+            open_archives.pop(key).close()
@@ -0,0 +1,75 @@
+"""
+Per-organization checkpoints of master data stages.
+
+Master files are marked as processed in the manifest only when all master stages are done,
+so checkpoints let a rerun after a failure skip stages that were completed for the same set of new master files.
+Orders do not need stage checkpoints: each batch is committed together with manifest entries of its files.
+"""
+import datetime
+import hashlib
+
+from app import db
+from app.models import IngestCheckpoint
+from app.mod_db_manage.utils import get_file_signature
+
+
+def get_files_hash(filepaths):
+    """
+    Hash of paths and signatures of files, changes when any file is added, removed or modified
+    :param filepaths: paths of files
+    :return: md5 hex digest
+    """
+    files_hash = hashlib.md5()
+
+    for filepath in sorted(filepaths):
+        size, mtime = get_file_signature(filepath)
+        files_hash.update("{}:{}:{}\n".format(filepath, size, mtime).encode("utf-8"))
+
+    return files_hash.hexdigest()
+
+
+class StageCheckpoints:
+    """
+    Completed stages of one organization for a certain set of files
+    Checkpoints saved for another set of files (new master files arrived since failure) are ignored
+    """
+    def __init__(self, org_id, filepaths):
+        """
+        :param org_id: ID of the organization
+        :param filepaths: paths of files processed by the stages
+        """
+        self.org_id = org_id
+        self.files_hash = get_files_hash(filepaths)
+        self.checkpoints = {checkpoint.stage: checkpoint
+                            for checkpoint in IngestCheckpoint.query.filter_by(org_id=org_id)}
+
+    def is_done(self, stage):
+        """
+        :param stage: stage name
+        :return: True if stage was completed for the same files
+        """
+        checkpoint = self.checkpoints.get(stage)
+
+        return checkpoint is not None and checkpoint.files_hash == self.files_hash
+
+    def mark_done(self, stage):
+        """
+        Save checkpoint of completed stage, caller commits it together with the stage data
+        :param stage: stage name
+        """
+        checkpoint = self.checkpoints.get(stage)
+
+        if checkpoint is None:
+            checkpoint = IngestCheckpoint(org_id=self.org_id, stage=stage)
+            self.checkpoints[stage] = checkpoint
+
+        checkpoint.files_hash = self.files_hash
+        checkpoint.date_time = datetime.datetime.utcnow()
+        db.session.add(checkpoint)
+
+    def clear(self):
+        """
+        Delete checkpoints of organization when all stages are done, caller commits
+        """
+        IngestCheckpoint.query.filter_by(org_id=self.org_id).delete()
+        self.checkpoints = {}
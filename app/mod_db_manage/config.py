@@ -19,3 +19,50 @@ PLU2ND_ITEM_TYPE = 3
 FIXED_TOTAL_TYPE = 4
 TENDER_FUNCTION_NUMBER = 2
 VOID_NAME_IDENTIFIER = "**VOID** "
+
+# processed files manifest statuses
+FILE_STATUS_PROCESSED = "processed"
+FILE_STATUS_FAILED = "failed"
+
+# XML files bigger than this size (in bytes) are parsed in streaming mode (iterparse)
+# set to 0 to stream every file, None to always build the whole tree
+XML_STREAMING_MIN_SIZE = 10 * 1024 * 1024
+
+# XML parser backend: "etree" (standard library) or "lxml" (faster, used only if lxml is installed)
+XML_BACKEND = "etree"
+
+# organization directory processing statuses (db_update.py summary)
+ORG_STATUS_PROCESSED = "processed"
+ORG_STATUS_ERROR = "error"
+ORG_STATUS_SKIPPED = "skipped"
+
+# parallel order parsing pipeline (db_update.py --parse_workers)
+ORDERS_BATCH_SIZE = 100  # orders written with one commit
+PIPELINE_QUEUE_SIZE = 1000  # parsed orders waiting for writer
+
+# order ingest backend (db_update.py --ingest_backend)
+# "orm" - row by row SQLAlchemy inserts, "copy" - PostgreSQL COPY to temporary tables and set-based inserts
+INGEST_BACKEND = "orm"
+COPY_BATCH_SIZE = 5000  # orders staged and inserted at once by "copy" backend
+
+# continuous ingest (db_update.py --watch)
+WATCH_POLL_INTERVAL = 1  # seconds between polls of data directory (max wait for inotify events)
+WATCH_DEBOUNCE = 3  # seconds file size and modification time must stay the same before file is ingested
+
+# archives read without extracting (see app/mod_db_manage/archives.py)
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# master data stages that have to be committed before a stage starts (db_update.py runs independent stages concurrently)
+MASTER_STAGE_DEPENDENCIES = {
+    "fixed_totalizer": (),
+    "free_function": (),
+    "group": (),
+    "department": ("group",),
+    "tax": (),
+    "plu": ("group", "department", "tax"),
+    "clerk": (),
+    "customer": (),
+}
+# master data stages looked up by order lines, orders are inserted as soon as they are committed
+ORDER_STAGE_DEPENDENCIES = ("fixed_totalizer", "free_function", "plu", "clerk", "customer")
+MASTER_STAGE_WORKERS = 4  # threads inserting master data, each uses its own database connection
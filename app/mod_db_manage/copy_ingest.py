@@ -0,0 +1,223 @@
+"""
+PostgreSQL COPY ingest backend for orders and order lines.
+
+Parsed orders are staged to temporary tables with COPY FROM STDIN,
+then foreign keys are resolved and duplicates are skipped with set-based INSERT ... SELECT.
+Follows the rules of DBInsert.insert_order / DBInsert.get_order_lines (db_update.py),
+but looks up free functions and fixed totalizers of the organization only.
+"""
+import io
+
+from app import db
+from app.mod_db_manage.config import PLU_ITEM_TYPE, FREE_FUNC_ITEM_TYPE, TEXT_ITEM_TYPE, PLU2ND_ITEM_TYPE, \
+    FIXED_TOTAL_TYPE, MAGIC_INDRAWER_NUMBER
+from app.mod_db_manage.instrumentation import ingest_stats
+from app.mod_db_manage.utils import iter_with_next
+
+
+ORDER_LINE_TYPES = (PLU_ITEM_TYPE, FREE_FUNC_ITEM_TYPE, PLU2ND_ITEM_TYPE, FIXED_TOTAL_TYPE)
+
+CREATE_STAGE_TABLES = """
+CREATE TEMPORARY TABLE stage_orders (
+    filepath text,
+    date_time timestamp,
+    mode text,
+    consecutive_number integer,
+    terminal_number integer,
+    terminal_name text,
+    clerk_number integer,
+    customer_number integer,
+    table_number integer
+) ON COMMIT DROP;
+
+CREATE TEMPORARY TABLE stage_order_lines (
+    filepath text,
+    line_number integer,
+    item_type integer,
+    item_number integer,
+    name text,
+    qty integer,
+    value double precision,
+    func_number integer,
+    change double precision,
+    special_free_func_name text,
+    fixed_total_number integer,
+    fixed_total_name text
+) ON COMMIT DROP;
+"""
+
+INSERT_ORDERS = """
+WITH new_orders AS (
+    INSERT INTO orders (date_time, filepath, org_id, mode, consecutive_number, terminal_number, terminal_name,
+                        clerk_id, customer_id, table_number)
+    SELECT DISTINCT ON (s.consecutive_number, s.date_time)
+           s.date_time, s.filepath, %(org_id)s, s.mode, s.consecutive_number, s.terminal_number, s.terminal_name,
+           (SELECT c.id FROM clerks c
+             WHERE c.org_id = %(org_id)s AND c.number = s.clerk_number ORDER BY c.id LIMIT 1),
+           (SELECT cu.id FROM customers cu
+             WHERE cu.org_id = %(org_id)s AND cu.number = s.customer_number ORDER BY cu.id LIMIT 1),
+           s.table_number
+      FROM stage_orders s
+     WHERE NOT EXISTS (SELECT 1 FROM orders o
+                        WHERE o.org_id = %(org_id)s
+                          AND o.consecutive_number = s.consecutive_number
+                          AND o.date_time = s.date_time)
+     ORDER BY s.consecutive_number, s.date_time, s.filepath
+    RETURNING id, filepath
+)
+INSERT INTO order_lines (order_id, item_type, func_number, name, qty, value, product_id, free_func_id, change,
+                         fixed_total_id)
+SELECT n.id, l.item_type, l.func_number, l.name, l.qty, l.value,
+       CASE WHEN l.item_type IN (%(plu_type)s, %(plu2nd_type)s) THEN
+           (SELECT p.id FROM plu p
+             WHERE p.org_id = %(org_id)s AND p.number = l.item_number ORDER BY p.id LIMIT 1)
+       END,
+       CASE WHEN l.item_type = %(free_func_type)s THEN
+           (SELECT f.id FROM free_functions f
+             WHERE f.org_id = %(org_id)s AND f.number = l.item_number ORDER BY f.id LIMIT 1)
+            WHEN l.special_free_func_name IS NOT NULL THEN
+           (SELECT f.id FROM free_functions f
+             WHERE f.org_id = %(org_id)s AND f.name = l.special_free_func_name ORDER BY f.id LIMIT 1)
+       END,
+       l.change,
+       CASE WHEN l.item_type = %(free_func_type)s THEN
+           (SELECT ft.id FROM fixed_totalizers ft
+             WHERE ft.org_id = %(org_id)s AND ft.number = l.fixed_total_number ORDER BY ft.id LIMIT 1)
+            WHEN l.item_type = %(fixed_total_type)s THEN
+           (SELECT ft.id FROM fixed_totalizers ft
+             WHERE ft.org_id = %(org_id)s AND ft.name = l.fixed_total_name ORDER BY ft.id LIMIT 1)
+       END
+  FROM stage_order_lines l
+  JOIN new_orders n ON n.filepath = l.filepath
+ ORDER BY n.id, l.line_number
+"""
+
+
+def prepare_order_lines(items):
+    """
+    Turn order items into plain order line rows, items that are not stored as order lines are skipped
+
+    :param items: ItemData objects of the order
+    :return: tuple (line_number, item_type, item_number, name, qty, value, func_number, change,
+    special_free_func_name, fixed_total_number, fixed_total_name)
+    """
+    for line_number, (item, next_item) in enumerate(iter_with_next(items)):
+        item_type = item.item_type
+        if item_type not in ORDER_LINE_TYPES:
+            continue
+
+        # VOID and CANCEL items are bound to VOID and CANCEL free functions
+        special_free_func_name = None
+        if "VD:" in item.name:
+            special_free_func_name = "VOID"
+        elif "CL:" in item.name:
+            special_free_func_name = "CANCEL"
+
+        func_number = None
+        change = None
+        fixed_total_number = None
+        fixed_total_name = None
+
+        if item_type == FREE_FUNC_ITEM_TYPE:
+            func_number = item.func_number
+            # for counting CAID, CRID, CHID and CQID (id-drawers)
+            fixed_total_number = int(item.option[-1]) + MAGIC_INDRAWER_NUMBER
+
+            # check if item has a change (for cash-type free functions)
+            if "CASH" in item.name and next_item is not None:
+                if next_item.item_type == TEXT_ITEM_TYPE and next_item.name == "CHANGE":
+                    change = next_item.value
+
+        elif item_type == FIXED_TOTAL_TYPE:
+            fixed_total_name = item.name
+
+        yield (line_number, item_type, item.item_number, item.name, item.qty, item.value, func_number, change,
+               special_free_func_name, fixed_total_number, fixed_total_name)
+
+
+def copy_value(value):
+    """Format value for COPY text format"""
+    if value is None:
+        return "\\N"
+
+    if hasattr(value, "isoformat"):
+        return value.isoformat(" ")
+
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(cursor, table, rows):
+    """
+    Load rows to table with COPY FROM STDIN
+    :param cursor: psycopg2 cursor
+    :param table: table name
+    :param rows: iterable of tuples
+    """
+    buffer = io.StringIO()
+
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row))
+        buffer.write("\n")
+
+    buffer.seek(0)
+    cursor.copy_expert("COPY {} FROM STDIN".format(table), buffer)
+
+
+class CopyOrderWriter:
+    """
+    Writes batches of orders of one organization with PostgreSQL COPY
+    Works in the transaction of current session, so manifest entries are committed together with orders
+    """
+    def __init__(self, org_id, manifest):
+        """
+        :param org_id: ID of the organization
+        :param manifest: FileManifest object of the organization
+        """
+        if db.engine.dialect.name != "postgresql":
+            raise ValueError("COPY ingest backend requires PostgreSQL database")
+
+        self.org_id = org_id
+        self.manifest = manifest
+
+    def write_batch(self, orders):
+        """
+        Insert orders and their order lines, duplicates of existing orders are skipped
+
+        :param orders: list of OrderData objects
+        """
+        order_rows = []
+        line_rows = []
+
+        for order in orders:
+            order_rows.append((order.filepath, order.date_time, order.mode, order.consecutive_number,
+                               order.terminal_number, order.terminal_name, order.clerk_number,
+                               order.customer_number, order.table_number))
+
+            for line in prepare_order_lines(order.items):
+                line_rows.append((order.filepath,) + line)
+
+        with ingest_stats.timer("insert"):
+            cursor = db.session.connection().connection.cursor()
+
+            try:
+                cursor.execute(CREATE_STAGE_TABLES)
+                copy_rows(cursor, "stage_orders", order_rows)
+                copy_rows(cursor, "stage_order_lines", line_rows)
+                cursor.execute(INSERT_ORDERS, {"org_id": self.org_id,
+                                               "plu_type": PLU_ITEM_TYPE,
+                                               "plu2nd_type": PLU2ND_ITEM_TYPE,
+                                               "free_func_type": FREE_FUNC_ITEM_TYPE,
+                                               "fixed_total_type": FIXED_TOTAL_TYPE})
+                inserted_lines = cursor.rowcount
+            finally:
+                cursor.close()
+
+        # skipped duplicate orders are counted too, INSERT_ORDERS reports order lines only
+        ingest_stats.count("rows", len(order_rows) + inserted_lines)
+
+        for order in orders:
+            self.manifest.mark(order.filepath)
+
+        with ingest_stats.timer("commit"):
+            db.session.commit()
+        print("Copied {} orders, {} order lines inserted".format(len(order_rows), inserted_lines))
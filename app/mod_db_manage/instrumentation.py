@@ -0,0 +1,168 @@
+"""
+Timings and counters of db_update.py ingest (db_update.py --bench)
+
+Stages:
+- scan: listing data directories and checking processed files manifest
+- parse: parsing XML files
+- lookup: searching duplicates and related objects (clerks, PLUs, free functions etc.)
+- insert: sending new rows to database
+- commit: committing transactions
+"""
+import resource
+import sys
+import threading
+import time
+
+
+INGEST_STAGES = ("scan", "parse", "lookup", "insert", "commit")
+
+
+class StageTimer:
+    """Context manager that adds elapsed time to a stage of IngestStats"""
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+        self.start_time = None
+
+    def __enter__(self):
+        if self.stats.enabled:
+            self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.start_time is not None:
+            self.stats.add(self.stage, time.time() - self.start_time)
+            self.start_time = None
+
+
+class IngestStats:
+    """
+    Accumulates time spent in each ingest stage and number of processed files and rows
+    Disabled by default, so instrumented code has almost no overhead
+    Can be shared by threads (master data stages run concurrently), their times are summed
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.timings = dict.fromkeys(INGEST_STAGES, 0)
+        self.counters = {"files": 0, "rows": 0}
+
+    def timer(self, stage):
+        """
+        :param stage: name of the stage (see INGEST_STAGES)
+        :return: context manager measuring time of the stage
+        """
+        return StageTimer(self, stage)
+
+    def timed(self, stage):
+        """
+        Decorator, adds time of each function call to the stage
+        :param stage: name of the stage (see INGEST_STAGES)
+        """
+        def decorator(func):
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+        return decorator
+
+    def timed_iter(self, items, stage):
+        """
+        Adds time spent on getting each item of an iterable (e.g. generator) to the stage,
+        time spent by consumer is not included
+        :param items: iterable
+        :param stage: name of the stage (see INGEST_STAGES)
+        :return: item
+        """
+        items = iter(items)
+
+        while True:
+            with self.timer(stage):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    def add(self, stage, seconds):
+        """
+        Add time to the stage (also time measured elsewhere, e.g. in parser processes)
+        """
+        if self.enabled:
+            with self.lock:
+                self.timings[stage] += seconds
+
+    def count(self, counter, number=1):
+        """
+        :param counter: "files" or "rows"
+        :param number: value to add
+        """
+        if self.enabled:
+            with self.lock:
+                self.counters[counter] += number
+
+    def pop(self):
+        """
+        Return accumulated values and start from zero
+        (db_update.py collects values of each organization, also from worker processes)
+        :return: dictionary {"timings": {stage: seconds}, "files": number, "rows": number}
+        """
+        values = {"timings": dict(self.timings)}
+        values.update(self.counters)
+        self.timings = dict.fromkeys(INGEST_STAGES, 0)
+        self.counters = {"files": 0, "rows": 0}
+
+        return values
+
+
+def get_peak_rss():
+    """
+    Peak resident set size of this process and its finished children (worker processes)
+    :return: megabytes
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    divider = 1024 * 1024 if sys.platform == "darwin" else 1024
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    return max(self_rss, children_rss) / divider
+
+
+def build_summary(values, elapsed, **extra):
+    """
+    Build machine-readable summary of the run
+    Stage times are summed over all processes, so with several workers they can exceed elapsed time
+
+    :param values: list of dictionaries returned by IngestStats.pop
+    :param elapsed: wall-clock time of the run in seconds
+    :param extra: additional keys of the summary
+    :return: dictionary, can be dumped to JSON
+    """
+    timings = dict.fromkeys(INGEST_STAGES, 0)
+    files = 0
+    rows = 0
+
+    for value in values:
+        for stage, seconds in value["timings"].items():
+            timings[stage] += seconds
+        files += value["files"]
+        rows += value["rows"]
+
+    summary = {
+        "elapsed": round(elapsed, 3),
+        "stages": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+        "files": files,
+        "rows": rows,
+        "files_per_second": round(files / elapsed, 1) if elapsed else 0,
+        "rows_per_second": round(rows / elapsed, 1) if elapsed else 0,
+        "peak_rss_mb": round(get_peak_rss(), 1),
+    }
+    summary.update(extra)
+
+    return summary
+
+
+# shared by ingest code, enabled by db_update.py --bench
+ingest_stats = IngestStats()
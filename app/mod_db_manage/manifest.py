@@ -0,0 +1,79 @@
+"""
+Manifest of processed XML files.
+Lets db_update.py skip files that were already ingested and did not change since then.
+"""
+import datetime
+
+from app import db
+from app.models import ProcessedFile
+from app.mod_db_manage.config import FILE_STATUS_PROCESSED, FILE_STATUS_FAILED
+from app.mod_db_manage.utils import get_file_signature, get_file_hash
+
+
+class FileManifest:
+    """
+    Keeps track of XML files of one organization
+
+    File is considered unchanged if its size and modification time match the manifest entry.
+    If only modification time differs (file was touched or copied again), content hash decides.
+    Files that failed (quarantined) are skipped the same way until they change.
+    """
+    def __init__(self, org_id, full_rescan=False):
+        """
+        :param org_id: ID of the organization
+        :param full_rescan: if True, every file is treated as new (manifest is still updated)
+        """
+        self.org_id = org_id
+        self.full_rescan = full_rescan
+        self.entries = {entry.filepath: entry for entry in ProcessedFile.query.filter_by(org_id=org_id)}
+
+    def is_new(self, filepath):
+        """
+        Checks if file has to be parsed
+
+        :param filepath: path of XML file
+        :return: True if file is not in manifest or changed, False if it can be skipped
+        """
+        if self.full_rescan:
+            return True
+
+        entry = self.entries.get(filepath)
+        if entry is None or entry.status not in (FILE_STATUS_PROCESSED, FILE_STATUS_FAILED):
+            return True
+
+        size, mtime = get_file_signature(filepath)
+        if size != entry.size:
+            return True
+
+        if mtime == entry.mtime:
+            return False
+
+        # same size, but different modification time: compare content
+        if get_file_hash(filepath) == entry.content_hash:
+            entry.mtime = mtime
+            db.session.add(entry)
+            return False
+
+        return True
+
+    def mark(self, filepath, status=FILE_STATUS_PROCESSED):
+        """
+        Adds or updates manifest entry of a file
+        Entry is added to current session only, caller commits it together with the file data
+
+        :param filepath: path of XML file
+        :param status: processing status (see app/mod_db_manage/config.py)
+        """
+        size, mtime = get_file_signature(filepath)
+        entry = self.entries.get(filepath)
+
+        if entry is None:
+            entry = ProcessedFile(org_id=self.org_id, filepath=filepath)
+            self.entries[filepath] = entry
+
+        entry.size = size
+        entry.mtime = mtime
+        entry.content_hash = get_file_hash(filepath)
+        entry.status = status
+        entry.date_time = datetime.datetime.utcnow()
+        db.session.add(entry)
@@ -0,0 +1,164 @@
+"""
+Producer / consumer pipeline for order files.
+
+A pool of parser processes turns order files into OrderData objects,
+single writer (caller's process) takes them from a bounded queue and writes them in batches.
+"""
+import multiprocessing
+import time
+import traceback
+
+from app.mod_db_manage.config import ORDERS_BATCH_SIZE, PIPELINE_QUEUE_SIZE
+from app.mod_db_manage.xml_parser import get_order
+
+
+def parse_worker(task_queue, result_queue, stats_queue):
+    """
+    Parser process: takes paths of order files from task queue until None is received
+
+    Puts (path, OrderData object, None) or (path, None, error message) to result queue,
+    its timings to stats queue and None to result queue when done.
+    """
+    stats = {"files": 0, "parse_time": 0, "blocked_time": 0}
+
+    for path in iter(task_queue.get, None):
+        start_time = time.time()
+        try:
+            order = get_order(path)
+            # streamed items can not be sent to another process
+            order.items = list(order.items)
+            result = (path, order, None)
+        except Exception:
+            result = (path, None, traceback.format_exc())
+
+        stats["files"] += 1
+        stats["parse_time"] += time.time() - start_time
+
+        # time spent here means writer is the bottleneck
+        start_time = time.time()
+        result_queue.put(result)
+        stats["blocked_time"] += time.time() - start_time
+
+    stats_queue.put(stats)
+    result_queue.put(None)
+
+
+class OrderPipeline:
+    """
+    Parses order files in parallel and feeds parsed orders to a single writer
+    """
+    def __init__(self, parse_workers, batch_size=ORDERS_BATCH_SIZE, queue_size=PIPELINE_QUEUE_SIZE):
+        """
+        :param parse_workers: number of parser processes
+        :param batch_size: number of orders passed to writer at once
+        :param queue_size: max number of parsed orders waiting for writer
+        """
+        self.parse_workers = parse_workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.stats = {}
+        self.errors = []
+
+    def run(self, order_files, write_batch, on_error=None):
+        """
+        Parse order files and write them
+
+        :param order_files: iterable with paths of order files
+        :param write_batch: function that takes list of OrderData objects and writes them
+        :param on_error: optional function, takes path and error message of a file that could not be parsed,
+        called by writer process between batches. If not given, ValueError is raised when all files are done
+        :return: dictionary with per-stage statistics (see report)
+        """
+        task_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue(maxsize=self.queue_size)
+        stats_queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=parse_worker, args=(task_queue, result_queue, stats_queue))
+                   for _ in range(self.parse_workers)]
+
+        start_time = time.time()
+        self.errors = []
+        self.stats = {"workers": self.parse_workers, "files": 0, "orders": 0, "parse_time": 0,
+                      "parser_blocked_time": 0, "write_time": 0, "writer_wait_time": 0}
+
+        for worker in workers:
+            worker.start()
+
+        try:
+            for path in order_files:
+                task_queue.put(path)
+                self.stats["files"] += 1
+
+            for _ in workers:
+                task_queue.put(None)
+
+            finished_workers = 0
+            batch = []
+
+            while finished_workers < len(workers):
+                # time spent here means parsers are the bottleneck
+                wait_start = time.time()
+                result = result_queue.get()
+                self.stats["writer_wait_time"] += time.time() - wait_start
+
+                if result is None:
+                    finished_workers += 1
+                    continue
+
+                path, order, error = result
+                if error is not None:
+                    if on_error is not None:
+                        on_error(path, error)
+                    else:
+                        self.errors.append((path, error))
+                    continue
+
+                batch.append(order)
+                if len(batch) >= self.batch_size:
+                    self.write(write_batch, batch)
+                    batch = []
+
+            if batch:
+                self.write(write_batch, batch)
+
+            for _ in workers:
+                worker_stats = stats_queue.get()
+                self.stats["parse_time"] += worker_stats["parse_time"]
+                self.stats["parser_blocked_time"] += worker_stats["blocked_time"]
+
+            for worker in workers:
+                worker.join()
+
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+
+        self.stats["elapsed"] = time.time() - start_time
+
+        if self.errors:
+            raise ValueError("{} order files could not be parsed:\n{}".format(
+                len(self.errors), "\n".join("{}\n{}".format(path, error) for path, error in self.errors)))
+
+        return self.stats
+
+    def write(self, write_batch, batch):
+        """Pass batch of parsed orders to writer and measure time"""
+        start_time = time.time()
+        write_batch(batch)
+        self.stats["write_time"] += time.time() - start_time
+        self.stats["orders"] += len(batch)
+
+    def report(self):
+        """
+        Per-stage throughput
+        :return: string with parsing and writing rates
+        """
+        stats = self.stats
+        parse_rate = stats["files"] / stats["parse_time"] * stats["workers"] if stats["parse_time"] else 0
+        write_rate = stats["orders"] / stats["write_time"] if stats["write_time"] else 0
+
+        return ("Parsing: {files} files, {parse_time:.2f} s in {workers} workers ({parse_rate:.1f} files/s), "
+                "blocked by writer {parser_blocked_time:.2f} s\n"
+                "Writing: {orders} orders, {write_time:.2f} s ({write_rate:.1f} orders/s), "
+                "waited for parsers {writer_wait_time:.2f} s\n"
+                "Total: {elapsed:.2f} s").format(parse_rate=parse_rate, write_rate=write_rate, **stats)
@@ -0,0 +1,83 @@
+"""
+Dependency-aware execution of ingest stages.
+
+Master data stages (see MASTER_STAGE_DEPENDENCIES in config.py) are run in a pool of threads,
+each stage starts as soon as all stages it depends on are committed.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class StageGraph:
+    """
+    Runs stages concurrently in the order given by their dependencies
+    """
+    def __init__(self, dependencies, max_workers):
+        """
+        :param dependencies: dictionary {stage name: names of stages that have to be done before}
+        :param max_workers: max number of stages running at once
+        """
+        self.dependencies = {stage: set(stage_dependencies) for stage, stage_dependencies in dependencies.items()}
+        self.max_workers = max_workers
+
+    def get_ready_stages(self, pending, stages, done):
+        """
+        :return: names of pending stages whose dependencies are done
+        (dependencies which are not among stages to run are considered done)
+        """
+        return [stage for stage in pending if self.dependencies.get(stage, set()) & set(stages) <= done]
+
+    def run(self, stages, on_done=None, final_stage=None, final_dependencies=()):
+        """
+        Run stages, the first error is raised when running stages are finished (stages depending
+        on failed stage are not started)
+
+        :param stages: dictionary {stage name: function}, functions are called in worker threads
+        :param on_done: optional function, takes name of completed stage, called in this thread
+        :param final_stage: optional function called in this thread as soon as final dependencies are done,
+        other stages keep running meanwhile
+        :param final_dependencies: names of stages final stage depends on
+        """
+        pending = dict(stages)
+        running = {}
+        done = set()
+        error = None
+        final_stage_started = final_stage is None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                if error is None:
+                    for stage in self.get_ready_stages(pending, stages, done):
+                        running[executor.submit(pending.pop(stage))] = stage
+
+                    if not final_stage_started and set(final_dependencies) & set(stages) <= done:
+                        final_stage_started = True
+                        try:
+                            final_stage()
+                        except Exception as e:
+                            error = e
+                        continue
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    stage = running.pop(future)
+
+                    try:
+                        future.result()
+                        if on_done is not None:
+                            on_done(stage)
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                        continue
+
+                    done.add(stage)
+
+        if error is not None:
+            raise error
+
+        if pending or not final_stage_started:
+            raise ValueError("Stages have circular dependencies: {}".format(", ".join(sorted(pending))))
@@ -1,7 +1,16 @@
+import hashlib
 import os
 import re
 import xml.etree.ElementTree as ET
+from decimal import Decimal, ROUND_HALF_UP
 
+from app.mod_db_manage.config import XML_STREAMING_MIN_SIZE, XML_BACKEND
+from app.mod_db_manage.archives import is_archive, list_archive_members, open_archive_member, close_archives
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 
 DATATYPES_NAMES = {
     "fixed_totalizer": "Fixed Totaliser",
@@ -15,20 +24,230 @@ DATATYPES_NAMES = {
     "tax_name": "Tax table"
 }
 
+# available XML parser backends, both provide parse and iterparse with the same element API
+XML_BACKENDS = {"etree": ET}
+
+if lxml_etree is not None:
+    XML_BACKENDS["lxml"] = lxml_etree
+
+xml_backend = ET
+
+
+def set_xml_backend(name):
+    """
+    Choose XML parser backend, standard library ElementTree is used if backend is not available
+    :param name: backend name (see XML_BACKENDS)
+    :return: name of the backend in use
+    """
+    global xml_backend
+
+    if name not in XML_BACKENDS:
+        name = "etree"
+
+    xml_backend = XML_BACKENDS[name]
+
+    return name
+
+
+set_xml_backend(XML_BACKEND)
+
+
+class OrgIndex:
+    """
+    Listing of organization directory tree built with os.scandir in one pass
+
+    Data storage can be mounted over network, so each directory is listed only once per run
+    and all discovery functions below consult the index instead of listing directories again.
+    Index keeps:
+    - names of group directories (all directories of organization directory)
+    - master files directories of each group directory (names containing 'master') and their files
+    - order files of each group directory
+    - size and modification time of order and master files
+
+    Zip and tar archives are indexed too (see app/mod_db_manage/archives.py):
+    archive in a group directory is treated as extracted into this group directory,
+    archive in organization directory is treated as extracted into organization directory.
+    Files on disk take precedence over archive members with the same path.
+    """
+    def __init__(self, org_path):
+        """
+        :param org_path: path of organization directory
+        """
+        self.org_path = org_path
+        self.group_dirs = []
+        # group directory name: list of (name, path) of its master files directories
+        self.master_files_dirs = {}
+        # path of master files directory: names of its files
+        self.master_files = {}
+        # group directory name: paths of its order files
+        self.order_files = {}
+        # path of data file: (size, mtime)
+        self.signatures = {}
+        # virtual path of archive member: (archive path, member name, content hash)
+        self.archive_members = {}
+
+        self.scan()
+
+    def scan(self):
+        # (archive path, group directory name or None for archives in organization directory)
+        archives = []
+
+        for group_entry in os.scandir(self.org_path):
+            if not group_entry.is_dir():
+                if is_archive(group_entry.name):
+                    archives.append((group_entry.path, None))
+                continue
+
+            group_dir_name = group_entry.name
+            self.add_group_dir(group_dir_name)
+
+            for entry in os.scandir(group_entry.path):
+                if entry.is_dir():
+                    if "master" in entry.name.lower():
+                        mf_dir = self.add_master_files_dir(group_dir_name, entry.name)
+                        self.scan_master_files_dir(mf_dir)
+
+                elif "Order" in entry.name:
+                    path = group_entry.path + "/" + entry.name
+                    self.order_files[group_dir_name].append(path)
+                    self.add_signature(path, entry)
+
+                elif is_archive(entry.name):
+                    archives.append((entry.path, group_dir_name))
+
+        for archive_path, group_dir_name in archives:
+            self.scan_archive(archive_path, group_dir_name)
+
+    def add_group_dir(self, group_dir_name):
+        if group_dir_name not in self.order_files:
+            self.group_dirs.append(group_dir_name)
+            self.master_files_dirs[group_dir_name] = []
+            self.order_files[group_dir_name] = []
+
+    def add_master_files_dir(self, group_dir_name, mf_dir_name):
+        """
+        :return: path of master files directory
+        """
+        mf_dir = os.path.join(self.org_path, group_dir_name, mf_dir_name)
+
+        if mf_dir not in self.master_files:
+            self.master_files_dirs[group_dir_name].append((mf_dir_name, mf_dir))
+            self.master_files[mf_dir] = []
+
+        return mf_dir
+
+    def scan_master_files_dir(self, mf_dir):
+        for entry in os.scandir(mf_dir):
+            self.master_files[mf_dir].append(entry.name)
+
+            if not entry.is_dir():
+                self.add_signature(os.path.join(mf_dir, entry.name), entry)
+
+    def scan_archive(self, archive_path, group_dir_name=None):
+        """
+        Index Order and Master files stored in an archive
+        :param archive_path: path of zip or tar archive
+        :param group_dir_name: group directory of the archive, None if archive contains group directories
+        """
+        for member in list_archive_members(archive_path):
+            parts = member.name.strip("/").split("/")
+            member_group_dir_name = group_dir_name
+
+            if member_group_dir_name is None:
+                if len(parts) < 2:
+                    continue
+                member_group_dir_name = parts.pop(0)
+
+            filename = parts[-1]
+            group_path = os.path.join(self.org_path, member_group_dir_name)
+
+            if len(parts) == 2 and "master" in parts[0].lower():
+                path = os.path.join(group_path, parts[0], filename)
+                if path in self.signatures:
+                    continue
+
+                self.add_group_dir(member_group_dir_name)
+                mf_dir = self.add_master_files_dir(member_group_dir_name, parts[0])
+                self.master_files[mf_dir].append(filename)
+
+            elif len(parts) == 1 and "Order" in filename:
+                path = group_path + "/" + filename
+                if path in self.signatures:
+                    continue
+
+                self.add_group_dir(member_group_dir_name)
+                self.order_files[member_group_dir_name].append(path)
+
+            else:
+                continue
+
+            self.signatures[path] = (member.size, member.mtime)
+            self.archive_members[path] = (archive_path, member.name, member.content_hash)
+
+    def add_signature(self, path, entry):
+        stat = entry.stat()
+        self.signatures[path] = (stat.st_size, stat.st_mtime)
+
+
+# path of organization directory: OrgIndex, kept until reset_org_index is called
+org_indexes = {}
+# path of data file: (size, mtime), signatures of all indexed files
+indexed_signatures = {}
+# virtual path: (archive path, member name, content hash), archive members of all indexed organizations
+indexed_archive_members = {}
+
+
+def get_org_index(org_path):
+    """
+    Get index of organization directory, directory tree is scanned on first call only
+    :param org_path: path of organization directory
+    :return: OrgIndex object
+    """
+    key = os.path.normpath(org_path)
+    index = org_indexes.get(key)
+
+    if index is None:
+        index = OrgIndex(org_path)
+        org_indexes[key] = index
+        indexed_signatures.update(index.signatures)
+        indexed_archive_members.update(index.archive_members)
+
+    return index
+
+
+def reset_org_index(org_path=None):
+    """
+    Forget index of organization directory, so new and changed files are found on next call of get_org_index
+    (db_update.py resets index before each organization is processed, --watch mode relies on it)
+    :param org_path: path of organization directory, all indexes are reset if None
+    """
+    if org_path is None:
+        keys = list(org_indexes)
+    else:
+        keys = [os.path.normpath(org_path)]
+
+    for key in keys:
+        index = org_indexes.pop(key, None)
+
+        if index is not None:
+            for path in index.signatures:
+                indexed_signatures.pop(path, None)
+
+            for path in index.archive_members:
+                indexed_archive_members.pop(path, None)
+
+            close_archives({archive_path for archive_path, _, _ in index.archive_members.values()})
+
+
 def check_group_dirs(org_data_path):
     """
     Checks whether organization directory contains Group directories
     :param org_data_path: path for organization directory
     :return: True if present, False if not present
     """
-    content = os.listdir(org_data_path)
-    for item_name in content:
-        item_path = os.path.join(org_data_path, item_name)
-
-        # a directory found, check if this is a group directory
-        if os.path.isdir(item_path):
-            if "group" in item_name.lower():
-                return True
+    for group_dir_name in get_org_index(org_data_path).group_dirs:
+        if "group" in group_dir_name.lower():
+            return True
 
     return False
 
@@ -40,36 +259,146 @@ def check_master_files_dirs(org_data_path):
     :param org_data_path: path for organization directory
     :return: True if present, False if not present
     """
-    content = os.listdir(org_data_path)
+    index = get_org_index(org_data_path)
+
+    for mf_dirs in index.master_files_dirs.values():
+        for mf_dir_name, mf_dir in mf_dirs:
+            # master files directory found
+            if 'master files' in mf_dir_name.lower() and len(index.master_files[mf_dir]) > 0:
+                return True
+
+    return False
+
+
+def get_file_signature(filepath):
+    """
+    Cheap file signature used to detect changed files without reading them
+    Signature is taken from organization directory index if file is indexed
+    :param filepath: path of the file
+    :return: tuple (size in bytes, modification time)
+    """
+    signature = indexed_signatures.get(filepath)
+    if signature is not None:
+        return signature
 
-    # go through each item in organization directory
-    for item_name in content:
-        item_path = os.path.join(org_data_path, item_name)
+    stat = os.stat(filepath)
 
-        if os.path.isdir(item_path):
-            group_dir_content = os.listdir(item_path)
+    return stat.st_size, stat.st_mtime
 
-            # go through each item of a directory
-            for group_dir_item_name in group_dir_content:
-                group_dir_item_path = os.path.join(item_path, group_dir_item_name)
 
-                # master files directory found
-                if os.path.isdir(group_dir_item_path) and 'master files' in group_dir_item_name.lower():
-                    master_files_content = os.listdir(group_dir_item_path)
-                    if len(master_files_content) > 0:
-                        return True
+def open_data_file(filepath):
+    """
+    Open data file for reading, archive members are read from their archives without extracting
+    :param filepath: path of the file or virtual path of archive member (see OrgIndex)
+    :return: binary file-like object
+    """
+    member = indexed_archive_members.get(filepath)
 
-    return False
+    if member is not None:
+        archive_path, member_name, _ = member
+        return open_archive_member(archive_path, member_name)
+
+    return open(filepath, "rb")
+
+
+def get_file_hash(filepath):
+    """Return md5 hex digest of a file content (hash stored in archive index for archive members)"""
+    member = indexed_archive_members.get(filepath)
+    if member is not None:
+        return member[2]
+
+    file_hash = hashlib.md5()
+
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
 
 
 def parse_xml(filename):
     """Return content of an XML file"""
-    tree = ET.parse(filename)
+    with open_data_file(filename) as f:
+        tree = xml_backend.parse(f)
     data = tree.getroot()
 
     return data
 
 
+def use_streaming(filename):
+    """
+    Checks if XML file is big enough to be parsed in streaming mode
+    :param filename: path of XML file
+    :return: True for streaming mode (StreamedXML), False for parse_xml
+    """
+    if XML_STREAMING_MIN_SIZE is None:
+        return False
+
+    return get_file_signature(filename)[0] >= XML_STREAMING_MIN_SIZE
+
+
+class StreamedXML:
+    """
+    Streaming XML reader built on iterparse.
+
+    Whole tree is never built: elements with requested tag are cleared and removed from their parent
+    as soon as consumer asks for the next one. Root element is available in 'root' attribute
+    and keeps only elements which are not streamed (header tags like Name, Date, Time).
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.root = None
+
+    def iter_elements(self, tag):
+        """
+        Get elements with given tag one by one
+        :param tag: tag to stream (for example, Record or Item)
+        :return: element, valid until next element is requested
+        """
+        parents = []
+
+        with open_data_file(self.filename) as f:
+            for event, elem in xml_backend.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    if self.root is None:
+                        self.root = elem
+                    parents.append(elem)
+                    continue
+
+                parents.pop()
+
+                if elem.tag == tag:
+                    yield elem
+
+                    # free consumed element
+                    elem.clear()
+                    if parents:
+                        parents[-1].remove(elem)
+
+
+def peek_xml_tag(filename, tag):
+    """
+    Get text of root's child tag, file is read only until the tag is found
+    :param filename: path of XML file
+    :param tag: tag name (for example, Name of master file)
+    :return: text of the tag or None if tag is not found
+    """
+    depth = 0
+
+    with open_data_file(filename) as f:
+        for event, elem in xml_backend.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                continue
+
+            depth -= 1
+
+            if depth == 1 and elem.tag == tag:
+                return elem.text
+
+    return None
+
+
 def get_xml_records(data):
     """Get data of a <Record> tag"""
     records_root = data.find("Records")
@@ -80,14 +409,11 @@ def get_xml_records(data):
 
 def get_order_xml(org_path):
     """Get xml with orders data"""
-    group_dirs_names = os.listdir(org_path)
-    for group_dir_name in group_dirs_names:
-        orders_xml_dir = os.path.join(org_path, group_dir_name)
-        orders_xml = os.listdir(orders_xml_dir)
-        
-        for of in orders_xml:
-            if "Order" in of:
-                yield orders_xml_dir + "/" + of
+    index = get_org_index(org_path)
+
+    for group_dir_name in index.group_dirs:
+        for of in index.order_files[group_dir_name]:
+            yield of
 
 
 def get_mfdir_anycase(group_path):
@@ -102,29 +428,70 @@ def get_mfdir_anycase(group_path):
     :param group_path: path of group directory
     :return: path for master files directory or None
     """
-    possible_dirs = os.listdir(group_path)
-    for dirname in possible_dirs:
-        dirname_lower = dirname.lower()
+    org_path, group_dir_name = os.path.split(os.path.normpath(group_path))
 
-        if 'master' in dirname_lower and os.path.isdir(os.path.join(group_path, dirname)):
-            return os.path.join(group_path, dirname)
-
-    return None
+    return get_mf_dir(org_path, group_dir_name)
 
 
 def get_mf_dir(org_path, group_dir_name):
     """Get xml files with Master Files data"""
-    group_path = os.path.join(org_path, group_dir_name)
-    master_files_dir = get_mfdir_anycase(group_path)
+    mf_dirs = get_org_index(org_path).master_files_dirs.get(group_dir_name)
+
+    # directory names containing 'master' are indexed only, first one is used
+    if not mf_dirs:
+        return None
 
-    return master_files_dir
+    return mf_dirs[0][1]
 
 
 def get_mf_xml(mf_dir):
     """Return all files from Master Files directories"""
-    master_files_xml = os.listdir(mf_dir)
+    if mf_dir is None:
+        return []
+
+    org_path = os.path.dirname(os.path.dirname(os.path.normpath(mf_dir)))
+    master_files_xml = get_org_index(org_path).master_files.get(mf_dir, [])
 
-    return master_files_xml
+    return list(master_files_xml)
+
+
+def iter_batches(items, batch_size):
+    """
+    Split iterable into lists of batch_size items (last one may be shorter)
+    :param items: iterable
+    :param batch_size: max number of items in a batch
+    :return: list of items
+    """
+    batch = []
+
+    for item in items:
+        batch.append(item)
+
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def iter_with_next(items):
+    """
+    Iterate over items together with the following item, works with any iterable (lists, streamed items)
+    :param items: iterable
+    :return: tuple (item, next item or None for the last item)
+    """
+    items = iter(items)
+    prev_item = next(items, None)
+
+    if prev_item is None:
+        return
+
+    for item in items:
+        yield prev_item, item
+        prev_item = item
+
+    yield prev_item, None
 
 
 def check_tag_length(tag_text):
@@ -139,3 +506,39 @@ def check_tag_length(tag_text):
         return True
     else:
         return False
+
+
+def parse_int(tag_text):
+    """
+    Convert text of a numeric tag to int
+    :param tag_text: text of the tag
+    :return: int or None for empty tag
+    """
+    if tag_text is None or not tag_text.strip():
+        return None
+
+    return int(tag_text)
+
+
+def parse_cents(tag_text):
+    """
+    Convert money value (for example, "-2.50") to integer number of cents, so values are exact
+    :param tag_text: text of the tag
+    :return: int or None for empty tag
+    """
+    if tag_text is None or not tag_text.strip():
+        return None
+
+    return int((Decimal(tag_text) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def cents_to_value(cents):
+    """
+    Convert cents back to value stored in database (Float columns)
+    :param cents: int or None
+    :return: float or None
+    """
+    if cents is None:
+        return None
+
+    return cents / 100
@@ -0,0 +1,211 @@
+"""
+Watches data directory for new Order and Master files.
+
+inotify is used if inotify_simple package is installed, otherwise the tree is polled.
+Files are handed over only when their size and modification time did not change
+for WATCH_DEBOUNCE seconds, so partially written files are not parsed.
+"""
+import os
+import time
+
+from app.mod_db_manage.config import WATCH_POLL_INTERVAL, WATCH_DEBOUNCE
+from app.mod_db_manage.archives import is_archive
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+
+def classify_data_file(data_path, path):
+    """
+    Find organization directory and kind of a data file
+
+    Order files lie in group directories: <org>/<group>/<...Order...>
+    Master files lie in master files directories: <org>/<group>/<Master Files>/<file>
+    Archives lie in organization or group directories: <org>/<archive> or <org>/<group>/<archive>
+
+    :param data_path: path of data storage
+    :param path: path of the file
+    :return: tuple (organization directory name, "order", "master" or "archive"), (None, None) for other files
+    """
+    parts = os.path.relpath(path, data_path).split(os.sep)
+
+    if len(parts) == 3 and "Order" in parts[2]:
+        return parts[0], "order"
+
+    if len(parts) == 4 and "master" in parts[2].lower():
+        return parts[0], "master"
+
+    if len(parts) in (2, 3) and is_archive(parts[-1]):
+        return parts[0], "archive"
+
+    return None, None
+
+
+def get_file_signature_or_none(path):
+    """Return (size, mtime) of a file or None if file does not exist anymore"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_size, stat.st_mtime
+
+
+class PollingSource:
+    """
+    Finds changed files by comparing signatures of all data files between polls
+    """
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        """
+        :return: dictionary {path of data file: (size, mtime)}
+        """
+        snapshot = {}
+        dirs = [self.data_path]
+
+        while dirs:
+            try:
+                entries = list(os.scandir(dirs.pop()))
+            except OSError:
+                continue
+
+            for entry in entries:
+                if entry.is_dir():
+                    dirs.append(entry.path)
+                elif classify_data_file(self.data_path, entry.path)[1] is not None:
+                    stat = entry.stat()
+                    snapshot[entry.path] = (stat.st_size, stat.st_mtime)
+
+        return snapshot
+
+    def get_changed_files(self, timeout):
+        """
+        Wait for poll interval and return files that are new or changed since last poll
+        :param timeout: seconds to wait
+        :return: list of paths
+        """
+        time.sleep(timeout)
+        snapshot = self.take_snapshot()
+        changed = [path for path, signature in snapshot.items() if self.snapshot.get(path) != signature]
+        self.snapshot = snapshot
+
+        return changed
+
+
+class InotifySource:
+    """
+    Finds changed files with inotify, every directory of data tree is watched (inotify is not recursive)
+    """
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.inotify = INotify()
+        self.mask = (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE |
+                     inotify_flags.MODIFY)
+        self.watches = {}
+
+        for dirpath, dirnames, filenames in os.walk(data_path):
+            self.add_watch(dirpath)
+
+    def add_watch(self, path):
+        wd = self.inotify.add_watch(path, self.mask)
+        self.watches[wd] = path
+
+    def get_changed_files(self, timeout):
+        """
+        Wait for events and return files which were created or written
+        :param timeout: seconds to wait for events
+        :return: list of paths
+        """
+        changed = []
+
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            dir_path = self.watches.get(event.wd)
+            if dir_path is None or not event.name:
+                continue
+
+            path = os.path.join(dir_path, event.name)
+
+            if event.mask & inotify_flags.ISDIR:
+                # new organization, group or master files directory
+                if event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO):
+                    for dirpath, dirnames, filenames in os.walk(path):
+                        self.add_watch(dirpath)
+                        changed.extend(os.path.join(dirpath, filename) for filename in filenames)
+                continue
+
+            changed.append(path)
+
+        return [path for path in changed if classify_data_file(self.data_path, path)[1] is not None]
+
+
+class DataDirWatcher:
+    """
+    Detects new and changed data files and hands them over organization by organization
+    """
+    def __init__(self, data_path, poll_interval=WATCH_POLL_INTERVAL, debounce=WATCH_DEBOUNCE, use_inotify=True):
+        """
+        :param data_path: path of data storage
+        :param poll_interval: seconds between polls (max wait for inotify events)
+        :param debounce: seconds file must stay unchanged before it is handed over
+        :param use_inotify: use inotify if inotify_simple is installed
+        """
+        self.data_path = data_path
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+
+        if use_inotify and INotify is not None:
+            self.source = InotifySource(data_path)
+        else:
+            self.source = PollingSource(data_path)
+
+        # path: (signature, time when signature was seen first)
+        self.pending = {}
+
+    def get_ready_files(self):
+        """
+        Collect changed files and return those which were not written to during debounce time
+        :return: dictionary {organization directory name: {"order": [paths], "master": [paths], "archive": [paths]}}
+        """
+        changed_files = self.source.get_changed_files(self.poll_interval)
+        now = time.time()
+
+        for path in changed_files:
+            self.pending.setdefault(path, (None, now))
+
+        ready = {}
+
+        for path, (signature, seen_time) in list(self.pending.items()):
+            current_signature = get_file_signature_or_none(path)
+
+            if current_signature is None:
+                del self.pending[path]
+            elif current_signature != signature:
+                # file is still being written
+                self.pending[path] = (current_signature, now)
+            elif now - seen_time >= self.debounce:
+                del self.pending[path]
+                org_dir, kind = classify_data_file(self.data_path, path)
+                ready.setdefault(org_dir, {"order": [], "master": [], "archive": []})[kind].append(path)
+
+        return ready
+
+    def watch(self, on_ready):
+        """
+        Run forever, call on_ready for each organization with ready files
+
+        :param on_ready: function, takes organization directory name, list of order files, list of master files,
+        list of archives and returns False if files have to be handed over again after debounce time (processing failed)
+        """
+        print("Watching {} ({})".format(self.data_path, self.source.__class__.__name__))
+
+        while True:
+            for org_dir, files in self.get_ready_files().items():
+                if on_ready(org_dir, files["order"], files["master"], files["archive"]) is False:
+                    now = time.time()
+                    for path in files["order"] + files["master"] + files["archive"]:
+                        self.pending[path] = (get_file_signature_or_none(path), now)
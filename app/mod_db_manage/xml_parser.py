@@ -1,20 +1,68 @@
+import traceback
 from datetime import datetime
 
 from app.mod_db_manage.utils import *
 from app.mod_db_manage.config import DATA_DIR
+from app.mod_db_manage.instrumentation import ingest_stats
 
 
-def get_orders_gen(org_path):
+def get_order_files_gen(org_path, file_filter=None):
+    """
+    Get paths of order XML files
+    :param org_path: path of Group directory with order XML files
+    :param file_filter: optional function, takes file path and returns False if file should be skipped
+    :return: path of order file
+    """
+    for of in get_order_xml(org_path):
+        if file_filter is not None and not file_filter(of):
+            continue
+
+        yield of
+
+
+def get_orders_gen(org_path, file_filter=None):
     """
     Get orders data
+    Each order file is parsed once, order items are available in OrderData.items
+    Big files (see XML_STREAMING_MIN_SIZE) are streamed: header is read first, items are streamed on demand
     :param org_path: path of Group directory with order XML files
+    :param file_filter: optional function, takes file path and returns False if file should be skipped
+    :return: OrderData class object
+    """
+    for of in get_order_files_gen(org_path, file_filter=file_filter):
+        yield get_order(of)
+
+
+def get_order(order_file):
+    """
+    Get order data of one order file
+    :param order_file: XML file from which order data will be extracted
     :return: OrderData class object
     """
-    order_files_gen = get_order_xml(org_path)
+    ingest_stats.count("files")
+
+    with ingest_stats.timer("parse"):
+        if use_streaming(order_file):
+            return get_streamed_order(order_file)
+
+        data = parse_xml(order_file)
 
-    for of in order_files_gen:
-        data = parse_xml(of)
-        yield OrderData(data, of)
+        return OrderData(data, order_file)
+
+
+def get_streamed_order(order_file):
+    """
+    Get order data of a big order file without building the whole tree
+    :param order_file: XML file from which order data will be extracted
+    :return: OrderData class object, its items are streamed from the file when iterated
+    """
+    stream = StreamedXML(order_file)
+
+    # skip items, only header tags are left in root element
+    for _ in stream.iter_elements("Item"):
+        pass
+
+    return OrderData(stream.root, order_file, items=StreamedOrderItems(order_file))
 
 
 def get_order_items_gen(order_file):
@@ -23,13 +71,27 @@ def get_order_items_gen(order_file):
     :param order_file: XML file from which order data will be extracted
     :return: ItemData class object
     """
-    data = parse_xml(order_file)
-    items = data.findall("Item")
+    if use_streaming(order_file):
+        items = StreamedXML(order_file).iter_elements("Item")
+    else:
+        items = parse_xml(order_file).findall("Item")
 
     for item in items:
         yield ItemData(item)
 
 
+class StreamedOrderItems:
+    """
+    Order items of a big order file
+    Items are not kept in memory, file is streamed each time object is iterated
+    """
+    def __init__(self, order_file):
+        self.order_file = order_file
+
+    def __iter__(self):
+        return ingest_stats.timed_iter(get_order_items_gen(self.order_file), "parse")
+
+
 def choose_data_class(name):
     """
     Matches tag name with associated class
@@ -58,14 +120,86 @@ def choose_data_class(name):
         return None
 
 
-def extract_master_files_data(org_path, data_type_name):
+def check_record_name(name_tag, record):
     """
-    Generic class for getting XML data
-    :param org_path: path of organization directory
-    :param data_type_name: name of data type needed (whether data should be searched for fixed totals, free functions etc.)
+    Checks that record is not empty
+    :param name_tag: name of data type of the master file
+    :param record: <Record> element
+    :return: True if record has a name, False if record should be discarded
+    """
+    # special case for Customer data type
+    if name_tag == DATATYPES_NAMES["customer_name"]:
+        customer_fname = record.find("FirstName").text
+        customer_sname = record.find("Surname").text
+
+        return check_tag_length(customer_fname) and check_tag_length(customer_sname)
+
+    # general way of getting record names
+    record_name = record.find("Name").text
+
+    return check_tag_length(record_name)
+
+
+def get_master_file_records(data, path):
+    """
+    Get records of a parsed master file, records with empty names are discarded
+    :param data: parsed master file (root element)
+    :param path: path of master file
     :return: <datatype> class object with parsed data
     """
-    group_dirs_names = os.listdir(org_path)
+    name_tag = data.find("Name").text
+    classname = choose_data_class(name_tag)
+
+    if classname is None:
+        return
+
+    date_time = get_master_file_date_time(data)
+    records = get_xml_records(data)
+
+    for record in records:
+        # discard empty tags
+        if not check_record_name(name_tag, record):
+            continue
+
+        yield classname(date_time, path, record)
+
+
+def get_streamed_master_file_records(path):
+    """
+    Same as get_master_file_records, but master file is streamed, records are freed once consumed
+    :param path: path of master file
+    :return: <datatype> class object with parsed data
+    """
+    stream = StreamedXML(path)
+    name_tag = None
+    classname = None
+    date_time = None
+
+    for record in stream.iter_elements("Record"):
+        if name_tag is None:
+            name_tag = stream.root.find("Name").text
+            classname = choose_data_class(name_tag)
+
+            if classname is None:
+                return
+
+            date_time = get_master_file_date_time(stream.root)
+
+        # discard empty tags
+        if not check_record_name(name_tag, record):
+            continue
+
+        yield classname(date_time, path, record)
+
+
+def get_master_files_gen(org_path, file_filter=None):
+    """
+    Get paths of all master files of organization
+    :param org_path: path of organization directory
+    :param file_filter: optional function, takes file path and returns False if file should be skipped
+    :return: path of master file
+    """
+    group_dirs_names = get_org_index(org_path).group_dirs
 
     for group_dir_name in group_dirs_names:
         mf_dir = get_mf_dir(org_path, group_dir_name)
@@ -74,103 +208,255 @@ def extract_master_files_data(org_path, data_type_name):
         # go through each master file in a directory
         # if there are several master files that represent same data type, they all will be processed
         for mf_file in mf_xml_files:
-            data = parse_xml(os.path.join(mf_dir, mf_file))
-            name_tag = data.find("Name").text
+            path = os.path.join(mf_dir, mf_file)
 
-            if name_tag == data_type_name:
-                records = get_xml_records(data)
+            if file_filter is not None and not file_filter(path):
+                continue
 
-                for record in records:
-                    # discard empty tags
+            yield path
 
-                    # special case for Customer data type
-                    if name_tag == DATATYPES_NAMES["customer_name"]:
-                        customer_fname = record.find("FirstName").text
-                        customer_sname = record.find("Surname").text
 
-                        if not check_tag_length(customer_fname) or not check_tag_length(customer_sname):
-                            continue
-                    # general way of getting record names
-                    else:
-                        record_name = record.find("Name").text
+def extract_master_files_data(org_path, data_type_name, file_filter=None):
+    """
+    Generic class for getting XML data
+    :param org_path: path of organization directory
+    :param data_type_name: name of data type needed (whether data should be searched for fixed totals, free functions etc.)
+    :param file_filter: optional function, takes file path and returns False if file should be skipped
+    :return: <datatype> class object with parsed data
+    """
+    for path in get_master_files_gen(org_path, file_filter=file_filter):
+        if use_streaming(path):
+            if peek_xml_tag(path, "Name") == data_type_name:
+                for record in get_streamed_master_file_records(path):
+                    yield record
+            continue
 
-                        if not check_tag_length(record_name):
-                            continue
+        data = parse_xml(path)
+        name_tag = data.find("Name").text
 
-                    path = os.path.join(mf_dir, mf_file)
-                    classname = choose_data_class(data_type_name)
+        if name_tag == data_type_name:
+            for record in get_master_file_records(data, path):
+                yield record
 
-                    yield classname(data, path, record)
 
-            else:
-                continue
+class MasterFilesScanner:
+    """
+    Parses each master file of organization only once
+
+    extract_master_files_data parses all master files for every data type,
+    scanner classifies each file by its <Name> tag and keeps records of all data types
+    until the end of the run.
+
+    Big master files (see XML_STREAMING_MIN_SIZE) are not kept in memory:
+    only their <Name> tag is read during scan, records are streamed when requested.
+    """
+    def __init__(self, org_path, file_filter=None, on_error=None):
+        """
+        :param org_path: path of organization directory
+        :param file_filter: optional function, takes file path and returns False if file should be skipped
+        :param on_error: optional function, takes path and error message of a master file that could not be parsed,
+        the file is skipped then. If not given, errors are raised
+        """
+        self.org_path = org_path
+        self.file_filter = file_filter
+        self.on_error = on_error
+        self.records = None
+        self.streamed_files = None
+
+    def scan(self):
+        """
+        Parse all master files and group their records by data type name
+        :return: dictionary {data type name: list of <datatype> class objects}
+        """
+        self.records = {}
+        self.streamed_files = {}
+
+        master_files = get_master_files_gen(self.org_path, file_filter=self.file_filter)
+
+        for path in ingest_stats.timed_iter(master_files, "scan"):
+            ingest_stats.count("files")
+
+            with ingest_stats.timer("parse"):
+                try:
+                    self.scan_file(path)
+                except Exception:
+                    if self.on_error is None:
+                        raise
+                    self.on_error(path, traceback.format_exc())
+
+        return self.records
+
+    def scan_file(self, path):
+        """
+        Parse master file and keep its records (only <Name> tag is read from big master files)
+        :param path: path of master file
+        """
+        if use_streaming(path):
+            name_tag = peek_xml_tag(path, "Name")
+
+            if choose_data_class(name_tag) is not None:
+                self.streamed_files.setdefault(name_tag, []).append(path)
+            return
+
+        data = parse_xml(path)
+        name_tag = data.find("Name").text
+
+        if choose_data_class(name_tag) is None:
+            return
+
+        # records are built before they are kept, so a broken file leaves no records behind
+        records = list(get_master_file_records(data, path))
+        self.records.setdefault(name_tag, []).extend(records)
+
+    def iter_records(self):
+        """
+        Get records of all data types
+        :return: tuple (data type name, <datatype> class object)
+        """
+        if self.records is None:
+            self.scan()
+
+        for data_type_name in set(self.records) | set(self.streamed_files):
+            for record in self.get_records(data_type_name):
+                yield data_type_name, record
+
+    def get_records(self, data_type_name):
+        """
+        Get records of certain data type, master files are scanned on first call only
+        :param data_type_name: name of data type needed (see DATATYPES_NAMES)
+        :return: list of <datatype> class objects (generator if there are big master files of this type)
+        """
+        if self.records is None:
+            self.scan()
+
+        records = self.records.get(data_type_name, [])
+        streamed_files = self.streamed_files.get(data_type_name)
+
+        if not streamed_files:
+            return records
+
+        return self.iter_streamed_records(records, streamed_files)
+
+    def iter_streamed_records(self, records, streamed_files):
+        """
+        Get cached records followed by records of big master files
+        :param records: list of cached <datatype> class objects
+        :param streamed_files: paths of big master files
+        :return: <datatype> class object
+        """
+        for record in records:
+            yield record
+
+        for path in streamed_files:
+            for record in ingest_stats.timed_iter(get_streamed_master_file_records(path), "parse"):
+                yield record
+
+
+def get_master_file_date_time(data):
+    """
+    Get date and time of master file, parsed once for all its records
+    :param data: root element of master file
+    :return: datetime object
+    """
+    date = data.find("Date").text
+    time = data.find("Time").text
+
+    return datetime.strptime(date + " " + time, "%d/%m/%Y %H:%M")
+
+
+# Parsed records use __slots__ (no per-instance dictionary): one order file produces an object per item
+# Values are converted once here: numbers to int, money to integer cents, date and time to datetime
 
 
 class MasterData():
-    def __init__(self, data, path):
-        date = data.find("Date").text
-        time = data.find("Time").text
-        self.date_time = datetime.strptime(date + " " + time, "%d/%m/%Y %H:%M")
+    __slots__ = ("date_time", "filepath", "data_dir")
+
+    def __init__(self, date_time, path):
+        self.date_time = date_time
         self.filepath = path
         self.data_dir = DATA_DIR
 
 
 class FixedTotalizerData(MasterData):
-    def __init__(self, data, path, record):
-        super(FixedTotalizerData, self).__init__(data, path)
-        self.number = record.find("Number").text
+    __slots__ = ("number", "name")
+
+    def __init__(self, date_time, path, record):
+        super(FixedTotalizerData, self).__init__(date_time, path)
+        self.number = parse_int(record.find("Number").text)
         self.name = record.find("Name").text
 
 
 class FreeFunctionData(MasterData):
-    def __init__(self, data, path, record):
-        super(FreeFunctionData, self).__init__(data, path)
-        self.number = record.find("Number").text
+    __slots__ = ("number", "name", "function_number")
+
+    def __init__(self, date_time, path, record):
+        super(FreeFunctionData, self).__init__(date_time, path)
+        self.number = parse_int(record.find("Number").text)
         self.name = record.find("Name").text.strip()
         self.function_number = record.find("FunctionNo").text
 
 
 class GroupData(MasterData):
-    def __init__(self,data, path, record):
-        super(GroupData, self).__init__(data, path)
-        self.number = record.find("Number").text
+    __slots__ = ("number", "name")
+
+    def __init__(self, date_time, path, record):
+        super(GroupData, self).__init__(date_time, path)
+        self.number = parse_int(record.find("Number").text)
         self.name = record.find("Name").text
 
 
 class DepartmentData(MasterData):
-    def __init__(self, data, path, record):
-        super(DepartmentData, self).__init__(data, path)
-        self.number = record.find("Number").text
+    __slots__ = ("number", "name", "group_number", "group_id")
+
+    def __init__(self, date_time, path, record):
+        super(DepartmentData, self).__init__(date_time, path)
+        self.number = parse_int(record.find("Number").text)
         self.name = record.find("Name").text
-        self.group_number = record.find("GroupNo").text
+        self.group_number = parse_int(record.find("GroupNo").text)
+        self.group_id = None
 
 
 class PLUData(MasterData):
-    def __init__(self, data, path, record):
-        super(PLUData, self).__init__(data, path)
-        self.number = record.find("Number").text
+    __slots__ = ("number", "name", "group_number", "department_number", "price_cents", "tax_number",
+                 "mix_match_number", "group_id", "department_id", "tax_id")
+
+    def __init__(self, date_time, path, record):
+        super(PLUData, self).__init__(date_time, path)
+        self.number = parse_int(record.find("Number").text)
         self.name = record.find("Name").text
-        self.group_number = record.find("GroupNo").text
-        self.department_number = record.find("DepartmentNo").text
-        self.price = record.find("Price").text
-        self.tax_number = record.find("TaxNo").text
+        self.group_number = parse_int(record.find("GroupNo").text)
+        self.department_number = parse_int(record.find("DepartmentNo").text)
+        self.price_cents = parse_cents(record.find("Price").text)
+        self.tax_number = parse_int(record.find("TaxNo").text)
         try:
             self.mix_match_number = record.find("MixMatch").text
         except:
             self.mix_match_number = None
+        self.group_id = None
+        self.department_id = None
+        self.tax_id = None
+
+    @property
+    def price(self):
+        return cents_to_value(self.price_cents)
 
 
 class ClerkData(MasterData):
-    def __init__(self, data, path, record):
-        super(ClerkData, self).__init__(data, path)
-        self.number = record.find("Number").text
+    __slots__ = ("number", "name")
+
+    def __init__(self, date_time, path, record):
+        super(ClerkData, self).__init__(date_time, path)
+        self.number = parse_int(record.find("Number").text)
         self.name = record.find("Name").text
 
 
 class CustomerData(MasterData):
-    def __init__(self, data, path, record):
-        super(CustomerData, self).__init__(data, path)
-        self.number = record.find("Number").text
+    __slots__ = ("number", "first_name", "surname", "addr1", "addr2", "addr3", "postcode", "phone", "email",
+                 "overdraft_limit", "custgroup_number")
+
+    def __init__(self, date_time, path, record):
+        super(CustomerData, self).__init__(date_time, path)
+        self.number = parse_int(record.find("Number").text)
         self.first_name = record.find("FirstName").text
         self.surname = record.find("Surname").text
         self.addr1 = record.find("Address1").text
@@ -180,48 +466,65 @@ class CustomerData(MasterData):
         self.phone = record.find("Telephone").text
         self.email = record.find("Email").text
         self.overdraft_limit = record.find("OverDraftLimit").text
-        self.custgroup_number = record.find("CustGroupNo").text
+        self.custgroup_number = parse_int(record.find("CustGroupNo").text)
 
 
 class TaxData(MasterData):
-    def __init__(self, data, path, record):
-        super(TaxData, self).__init__(data, path)
-        self.number = record.find("Number").text
+    __slots__ = ("number", "name", "rate")
+
+    def __init__(self, date_time, path, record):
+        super(TaxData, self).__init__(date_time, path)
+        self.number = parse_int(record.find("Number").text)
         self.name = record.find("Name").text
+        # stored as is, format of the rate is up to the database column
         self.rate = record.find("Rate").text
 
 
 class OrderData():
-    def __init__(self, order, path):
+    __slots__ = ("date_time", "mode", "consecutive_number", "terminal_number", "terminal_name", "clerk_number",
+                 "table_number", "filepath", "customer_number", "items")
+
+    def __init__(self, order, path, items=None):
         date = order.find("Date").text
         time = order.find("Time").text
         self.date_time = datetime.strptime(date + " " + time, "%d/%m/%Y %H:%M:%S")
         self.mode = order.find("Mode").text
-        self.consecutive_number = order.find("ConsecutiveNo").text
-        self.terminal_number = order.find("TerminalNo").text
+        self.consecutive_number = parse_int(order.find("ConsecutiveNo").text)
+        self.terminal_number = parse_int(order.find("TerminalNo").text)
         self.terminal_name = order.find("TerminalName").text
-        self.clerk_number = order.find("ClerkNo").text
-        self.table_number = order.find("TableNo").text
+        self.clerk_number = parse_int(order.find("ClerkNo").text)
+        self.table_number = parse_int(order.find("TableNo").text)
         self.filepath = path
         try:
-            self.customer_number = order.find("Customer").find("CustomerID").text
+            self.customer_number = parse_int(order.find("Customer").find("CustomerID").text)
         except:
             self.customer_number = None
 
+        # order items come from the same parsed file, no need to read it again
+        if items is None:
+            items = [ItemData(item) for item in order.findall("Item")]
+        self.items = items
+
 
 class ItemData():
+    __slots__ = ("item_type", "item_number", "name", "qty", "value_cents", "option", "func_number")
+
     def __init__(self, item):
-        self.item_type = item.find("ItemType").text
-        self.item_number = item.find("ItemNo").text
+        self.item_type = parse_int(item.find("ItemType").text)
+        self.item_number = parse_int(item.find("ItemNo").text)
         self.name = item.find("ItemName").text
-        self.qty = item.find("Qty").text
-        self.value = item.find("Value").text
+        self.qty = parse_int(item.find("Qty").text)
+        self.value_cents = parse_cents(item.find("Value").text)
         try:
             self.option = item.find("Options").text
         except:
             self.option = None
 
         try:
-            self.func_number = item.find("FuncNo").text
+            self.func_number = parse_int(item.find("FuncNo").text)
         except:
             self.func_number = None
+
+    @property
+    def value(self):
+        return cents_to_value(self.value_cents)
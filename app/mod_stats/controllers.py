@@ -1,9 +1,11 @@
-from flask import Blueprint, render_template, url_for, redirect
+from flask import Blueprint, render_template, url_for, redirect, current_app, abort
 from flask_login import current_user
 from flask.views import View
 from sqlalchemy.exc import OperationalError
 
-from app.models import Organization, Order, User
+from app import db
+from app.db_routing import is_statement_timeout
+from app.models import Order
 from app.mod_stats.stats_utils import StatsDataExtractor, calc_today_timeframe, calc_yesterday_timeframe, \
     calc_this_week_timeframe, calc_last_week_timeframe, calc_this_month_timeframe, calc_last_month_timeframe, \
     calc_this_quarter_timeframe, calc_last_quarter_timeframe
@@ -24,15 +26,27 @@ def check_authenticated_user():
     if not current_user.is_authenticated:
         return redirect(url_for("auth.login"))
 
+    # statistics are read from replica if configured (StatsDataExtractor falls back to primary if replica lags)
+    db.use_read_bind(current_app.config.get("STATS_READ_BIND"))
+
 
 @mod_stats.errorhandler(OperationalError)
 def handle_operational_error(error):
     """
     Handles situation when there's no connection with database
+    or statistics query was cancelled by statement timeout (STATEMENT_TIMEOUTS in config.py)
 
     :param error: occured database connection error
     :return: according message
     """
+    if is_statement_timeout(error):
+        # failed transaction has to be rolled back before the page is rendered (current user is reloaded)
+        db.session.rollback()
+
+        return render_template("stats/base.html",
+                               error_message="The selected date range is too large to be shown. "
+                                             "Please choose a shorter period."), 503
+
     return "No connection with database"
 
 
@@ -45,12 +59,21 @@ def get_order_details(org_id, order_id):
     :param order_id: id of the order
     :return: "stats/order_details.html" template with parameters
     """
-    order = Order.query.filter_by(id=order_id).first()
+    organization = current_user.get_organization(org_id)
+    if organization is None:
+        abort(404)
+
+    # order may be just ingested and not replicated yet
+    with db.read_from(None):
+        order = Order.query.filter_by(id=order_id, org_id=organization.id).first()
+    if order is None:
+        abort(404)
+
     start_datetime = order.date_time
     end_datetime = order.date_time
 
     # sales details
-    data_handler = StatsDataExtractor(org_id, start_datetime, end_datetime)
+    data_handler = StatsDataExtractor(organization.id, start_datetime, end_datetime)
     plu_sales_data = data_handler.get_plu_sales_data(detailed_report=True)
     free_func_sales_data = data_handler.get_free_func(detailed_report=True)
     change = data_handler.calculate_change()
@@ -60,7 +83,7 @@ def get_order_details(org_id, order_id):
 
     # order details
     clerk_name = order.clerk.name
-    site = Organization.query.filter_by(id=org_id).first().name
+    site = organization.name
     total_sale = data_handler.calculate_total_sales()
 
     return render_template("stats/order_details.html",
@@ -111,14 +134,22 @@ class ShowDataView(View):
         except:
             pass
 
-        user = User.query.filter_by(id=current_user.id).first()
+        # user and organizations loaded once per request (see load_user)
+        user = current_user
 
         # user does not have any organizations
         if not user.organizations:
             return render_template("stats/base.html", error_message="You do not have any organizations yet.")
 
         self.org_id = self.check_org_id(user, self.org_id)
-        org_name = Organization.query.filter_by(id=self.org_id).first().name
+
+        # user can see statistics of assigned organizations only
+        organization = user.get_organization(self.org_id)
+        if organization is None:
+            abort(404)
+
+        self.org_id = organization.id
+        org_name = organization.name
 
         # getting statistics data
         data_handler = StatsDataExtractor(self.org_id, self.start_datetime, self.end_datetime)
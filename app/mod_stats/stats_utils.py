@@ -8,8 +8,11 @@ import datetime
 from dateutil.relativedelta import relativedelta
 from decimal import Decimal, ROUND_HALF_UP
 from sqlalchemy import and_
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 
-from app.models import OrderLine, Order, Organization
+from app import db
+from app.models import OrderLine, Order, Organization, PLU
+from app.performance import timed_section
 from app.mod_db_manage.config import FREE_FUNC_ITEM_TYPE, PLU_ITEM_TYPE, PLU2ND_ITEM_TYPE, TENDER_FUNCTION_NUMBER,\
     VOID_NAME_IDENTIFIER
 
@@ -347,13 +350,36 @@ class StatsDataExtractor:
         self.org_id = org_id
         self.start_time = start_time
         self.end_time = end_time
-        self.orderlines = OrderLine.query.join(OrderLine.order).filter(
+        # replica (if configured) or primary database when replica lags behind the period
+        self.read_bind = db.get_stats_read_bind(end_time)
+        # related objects used by the methods below are loaded by the same query,
+        # otherwise each orderline would lazy load its PLU, free function, clerk etc. (N+1 queries)
+        self.orderlines_query = OrderLine.query.join(OrderLine.order).filter(
             and_(
                 Order.org_id == org_id,
                 Order.date_time >= self.start_time,
                 Order.date_time <= self.end_time
                 )
+            ).options(
+                contains_eager(OrderLine.order).joinedload(Order.clerk),
+                joinedload(OrderLine.plu).joinedload(PLU.tax),
+                joinedload(OrderLine.plu).joinedload(PLU.department),
+                joinedload(OrderLine.plu).joinedload(PLU.group),
+                joinedload(OrderLine.free_function),
+                joinedload(OrderLine.fixed_totalizer),
             )
+        self._orderlines = None
+
+    @property
+    def orderlines(self):
+        """
+        Orderlines of the period, loaded on first use and shared by all methods
+        """
+        if self._orderlines is None:
+            with db.read_from(self.read_bind):
+                self._orderlines = self.orderlines_query.all()
+
+        return self._orderlines
 
     def dict_write_values(self, dictionary, entry_id, name, price, qty, unique_id=""):
         """
@@ -391,6 +417,7 @@ class StatsDataExtractor:
 
         return dictionary
 
+    @timed_section
     def get_department_sales_data(self):
         """
         Get Department sales
@@ -417,6 +444,7 @@ class StatsDataExtractor:
         
         return data_dict
 
+    @timed_section
     def get_fixed_totalizers(self):
         """
         Accumulates values for fixed totals according to asked period of time
@@ -479,6 +507,7 @@ class StatsDataExtractor:
 
         return data_dict
 
+    @timed_section
     def get_plu_sales_data(self, detailed_report=False):
         """
         Get PLU sales
@@ -513,26 +542,26 @@ class StatsDataExtractor:
 
         return data_dict
 
+    @timed_section
     def get_last_100_sales(self):
         """
         Get last 100 sales
         """
-        orders = Order.query.filter(and_(
-            Order.org_id == self.org_id,
-            Order.date_time >= self.start_time,
-            Order.date_time <= self.end_time
-        )
-        ).order_by(Order.date_time.desc()).all()
-
-        if len(orders) > 100:
-            orders = orders[:100]
+        with db.read_from(self.read_bind):
+            orders = Order.query.filter(and_(
+                Order.org_id == self.org_id,
+                Order.date_time >= self.start_time,
+                Order.date_time <= self.end_time
+            )
+            ).order_by(Order.date_time.desc()).limit(100).options(selectinload(Order.items)).all()
+            # organization is usually loaded already with current user (get() does not query it again)
+            site = Organization.query.get(int(self.org_id)).name
 
         data_dict = {}
 
         for order in orders:
             date_time = order.date_time
             sale_id = order.id
-            site = Organization.query.filter_by(id=self.org_id).first().name
             sales_total = 0
             
             for item in order.items:
@@ -554,6 +583,7 @@ class StatsDataExtractor:
 
         return data_dict
 
+    @timed_section
     def get_clerks_breakdown(self):
         """
         Get Clerks breakdown sales
@@ -576,6 +606,7 @@ class StatsDataExtractor:
 
         return data_dict
 
+    @timed_section
     def get_group_sales_data(self):
         """
         Get Group sales
@@ -601,6 +632,7 @@ class StatsDataExtractor:
 
         return data_dict
 
+    @timed_section
     def get_free_func(self, detailed_report=False):
         """
         Get Free functions data
@@ -687,6 +719,7 @@ class StatsDataExtractor:
         else:
             return ol.qty
 
+    @timed_section
     def calculate_change(self):
         """
         Sums up Free Function items with CHANGE field
@@ -703,6 +736,7 @@ class StatsDataExtractor:
 
         return PriceValue(total_change).get_value()
 
+    @timed_section
     def calculate_total_sales(self):
         """
         Calculates total sum of Free Function items, change is considered
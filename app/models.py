@@ -1,6 +1,6 @@
 from flask_login import UserMixin
 # from sqlalchemy import Table, Column, String, Integer, Float, DateTime, ForeignKey, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import joinedload, relationship
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from app import db, login
@@ -37,10 +37,36 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    @property
+    def default_org_id(self):
+        """
+        ID of organization shown after login, 0 if user has no organizations (see ShowDataView.check_org_id)
+        """
+        if self.organizations:
+            return self.organizations[0].id
+
+        return 0
+
+    def get_organization(self, org_id):
+        """
+        Membership check, uses organizations loaded with the user (no query)
+        :param org_id: ID of organization (integer or string from URL)
+        :return: Organization object if user is assigned to it, None otherwise
+        """
+        for org in self.organizations:
+            if str(org.id) == str(org_id):
+                return org
+
+        return None
+
 
 @login.user_loader
 def load_user(id):
-    user_id = db.session.query(User).get(int(id))
+    """
+    Load user once per request (Flask-Login keeps it as current_user) together with organizations,
+    views and membership checks use them without further queries
+    """
+    user_id = db.session.query(User).options(joinedload(User.organizations)).get(int(id))
 
     return user_id
 
@@ -51,18 +77,21 @@ class Organization(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, index=True)
     data_dir = db.Column(db.String(200), unique=True, index=True)
+    # rows of organization are deleted by database (ondelete="CASCADE" foreign keys),
+    # passive_deletes keeps the ORM from loading them (all orders and orderlines) before deleting the organization
     users = db.relationship("User",
                          secondary=users_orgs_association_table,
-                         back_populates="organizations")
-    fixed_totalizers = db.relationship("FixedTotalizer", cascade="delete")
-    free_functions = db.relationship("FreeFunction", cascade="delete")
-    groups = db.relationship("Group", cascade="delete")
-    departments = db.relationship("Department", cascade="delete")
-    taxes = db.relationship("Tax", cascade="delete")
-    plus = db.relationship("PLU", cascade="delete")
-    clerks = db.relationship("Clerk", cascade="delete")
-    customers = db.relationship("Customer", cascade="delete")
-    orders = db.relationship("Order", cascade="delete")
+                         back_populates="organizations",
+                         passive_deletes=True)
+    fixed_totalizers = db.relationship("FixedTotalizer", cascade="delete", passive_deletes=True)
+    free_functions = db.relationship("FreeFunction", cascade="delete", passive_deletes=True)
+    groups = db.relationship("Group", cascade="delete", passive_deletes=True)
+    departments = db.relationship("Department", cascade="delete", passive_deletes=True)
+    taxes = db.relationship("Tax", cascade="delete", passive_deletes=True)
+    plus = db.relationship("PLU", cascade="delete", passive_deletes=True)
+    clerks = db.relationship("Clerk", cascade="delete", passive_deletes=True)
+    customers = db.relationship("Customer", cascade="delete", passive_deletes=True)
+    orders = db.relationship("Order", cascade="delete", passive_deletes=True)
 
 
 class Master(db.Model):
@@ -207,7 +236,7 @@ class Order(db.Model):
     customer_id = db.Column(db.Integer, db.ForeignKey("customers.id"), nullable=True)
     table_number = db.Column(db.Integer)
     payment_type = db.Column(db.String(20))
-    items = relationship("OrderLine", back_populates="order", cascade="all, delete-orphan")
+    items = relationship("OrderLine", back_populates="order", cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return "Order: ID=%s" % (self.id)
@@ -241,3 +270,37 @@ class OrderLine(db.Model):
     def __repr__(self):
         return "OrderLine: id=%s order_id=%s product_id=%s qty=%s value=%s" % (
                 self.id, self.order_id, self.product_id, self.qty, self.value)
+
+
+class ProcessedFile(db.Model):
+    """Manifest of XML files already handled by db_update.py (lets next runs skip unchanged files)"""
+    __tablename__ = "processed_files"
+    __table_args__ = (db.UniqueConstraint("org_id", "filepath"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    org_id = db.Column(db.Integer, db.ForeignKey("organizations.id", ondelete="CASCADE"), nullable=False)
+    filepath = db.Column(db.String(300), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    mtime = db.Column(db.Float, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    date_time = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return "Processed File: id=%s filepath=%s status=%s" % (self.id, self.filepath, self.status)
+
+
+class IngestCheckpoint(db.Model):
+    """Completed ingest stage of organization (db_update.py resumes from the first stage without checkpoint)"""
+    __tablename__ = "ingest_checkpoints"
+    __table_args__ = (db.UniqueConstraint("org_id", "stage"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    org_id = db.Column(db.Integer, db.ForeignKey("organizations.id", ondelete="CASCADE"), nullable=False)
+    stage = db.Column(db.String(50), nullable=False)
+    files_hash = db.Column(db.String(64), nullable=False)
+    date_time = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return "Ingest Checkpoint: id=%s org_id=%s stage=%s" % (self.id, self.org_id, self.stage)
+
@@ -0,0 +1,233 @@
+"""
+Opt-in per-request performance accounting (set PERFORMANCE_MONITORING = True in config.py)
+
+For each request records:
+- number of SQL queries and total SQL time (SQLAlchemy before_cursor_execute / after_cursor_execute events)
+- template render time (Flask before_render_template / template_rendered signals)
+- time spent in StatsDataExtractor methods (timed_section decorator)
+
+Values are sent in Server-Timing header (visible in browser developer tools) and logged as JSON lines
+by "app.performance" logger. Requests exceeding PERFORMANCE_BUDGETS are logged as warnings.
+"""
+import functools
+import json
+import logging
+import time
+
+from flask import g, request, has_request_context, signals_available, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger("app.performance")
+
+
+class QueryCounter:
+    """
+    Counts SQL queries executed while active, can be used outside of requests:
+
+        with QueryCounter() as counter:
+            ...
+        print(counter.count, counter.duration)
+    """
+    def __init__(self, engine=Engine, keep_statements=False):
+        """
+        :param engine: Engine object or Engine class (all engines)
+        :param keep_statements: if True, executed statements are kept in 'statements' list
+        """
+        self.engine = engine
+        self.keep_statements = keep_statements
+        self.count = 0
+        self.duration = 0
+        self.statements = []
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_counter_start_time", []).append(time.time())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.duration += time.time() - conn.info["query_counter_start_time"].pop()
+
+        if self.keep_statements:
+            self.statements.append(statement)
+
+    def get_repeated_statements(self, max_repeats):
+        """
+        Find statements executed more than max_repeats times (typically lazy loads in a loop, N+1 queries)
+        Statements are parameterised, so the same query with different values is counted as one statement
+
+        :param max_repeats: allowed number of executions of one statement
+        :return: dictionary {statement: number of executions}, needs keep_statements=True
+        """
+        repeats = {}
+        for statement in self.statements:
+            repeats[statement] = repeats.get(statement, 0) + 1
+
+        return {statement: number for statement, number in repeats.items() if number > max_repeats}
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(self.engine, "after_cursor_execute", self.after_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        event.remove(self.engine, "before_cursor_execute", self.before_cursor_execute)
+        event.remove(self.engine, "after_cursor_execute", self.after_cursor_execute)
+
+
+class RequestTimings:
+    """Performance values of one request, kept in flask.g while request is handled"""
+    def __init__(self):
+        self.start_time = time.time()
+        self.query_count = 0
+        self.sql_time = 0
+        self.template_time = 0
+        self.template_start_times = []
+        # section name: seconds
+        self.sections = {}
+
+    def add_section(self, name, seconds):
+        self.sections[name] = self.sections.get(name, 0) + seconds
+
+
+def get_request_timings():
+    """
+    :return: RequestTimings object of current request or None if monitoring is off or there is no request
+    """
+    if not has_request_context():
+        return None
+
+    return getattr(g, "performance_timings", None)
+
+
+def timed_section(func):
+    """
+    Decorator, adds time of each call to the request's section named after the function
+    (used for StatsDataExtractor methods), no-op if monitoring is off
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = get_request_timings()
+        if timings is None:
+            return func(*args, **kwargs)
+
+        start_time = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.add_section(func.__name__, time.time() - start_time)
+
+    return wrapper
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if get_request_timings() is not None:
+        conn.info.setdefault("request_query_start_time", []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = get_request_timings()
+    start_times = conn.info.get("request_query_start_time")
+
+    if timings is not None and start_times:
+        timings.query_count += 1
+        timings.sql_time += time.time() - start_times.pop()
+
+
+def on_before_render_template(sender, template, context, **extra):
+    timings = get_request_timings()
+    if timings is not None:
+        timings.template_start_times.append(time.time())
+
+
+def on_template_rendered(sender, template, context, **extra):
+    timings = get_request_timings()
+    if timings is not None and timings.template_start_times:
+        timings.template_time += time.time() - timings.template_start_times.pop()
+
+
+def start_request_timings():
+    g.performance_timings = RequestTimings()
+
+
+def get_exceeded_budgets(values, budgets):
+    """
+    :param values: dictionary of measured values (see finish_request_timings)
+    :param budgets: dictionary {value name: max value}
+    :return: names of values exceeding their budgets
+    """
+    return sorted(name for name, budget in budgets.items()
+                  if budget is not None and values.get(name, 0) > budget)
+
+
+def format_server_timing(values, sections, exceeded):
+    """
+    :return: value of Server-Timing header
+    """
+    metrics = ['total;dur={:.1f}'.format(values["duration_ms"]),
+               'sql;dur={:.1f};desc="{} queries"'.format(values["sql_ms"], values["query_count"]),
+               'tpl;dur={:.1f}'.format(values["template_ms"])]
+    metrics.extend('{};dur={:.1f}'.format(name, seconds * 1000) for name, seconds in sorted(sections.items()))
+
+    if exceeded:
+        metrics.append('budget;desc="exceeded: {}"'.format(" ".join(exceeded)))
+
+    return ", ".join(metrics)
+
+
+def finish_request_timings(response, budgets):
+    """
+    Add Server-Timing header to response and log request's performance values
+    """
+    timings = get_request_timings()
+    if timings is None:
+        return response
+
+    values = {
+        "duration_ms": round((time.time() - timings.start_time) * 1000, 1),
+        "query_count": timings.query_count,
+        "sql_ms": round(timings.sql_time * 1000, 1),
+        "template_ms": round(timings.template_time * 1000, 1),
+    }
+    exceeded = get_exceeded_budgets(values, budgets)
+
+    response.headers["Server-Timing"] = format_server_timing(values, timings.sections, exceeded)
+
+    log_record = {"method": request.method, "path": request.path, "endpoint": request.endpoint,
+                  "status": response.status_code,
+                  "sections_ms": {name: round(seconds * 1000, 1) for name, seconds in timings.sections.items()},
+                  "over_budget": exceeded}
+    log_record.update(values)
+
+    if exceeded:
+        logger.warning(json.dumps(log_record, sort_keys=True))
+    else:
+        logger.info(json.dumps(log_record, sort_keys=True))
+
+    return response
+
+
+def init_performance(app):
+    """
+    Register performance accounting hooks if PERFORMANCE_MONITORING is enabled in app config
+    :param app: Flask application
+    """
+    if not app.config.get("PERFORMANCE_MONITORING"):
+        return
+
+    budgets = app.config.get("PERFORMANCE_BUDGETS", {})
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+    # template signals need blinker package
+    if signals_available:
+        before_render_template.connect(on_before_render_template, app)
+        template_rendered.connect(on_template_rendered, app)
+
+    app.before_request(start_request_timings)
+    app.after_request(lambda response: finish_request_timings(response, budgets))
+
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
@@ -0,0 +1,74 @@
+import xml.etree.ElementTree as ET
+
+from app.mod_db_manage.copy_ingest import prepare_order_lines
+from app.mod_db_manage.xml_parser import ItemData
+
+
+ORDER_ITEMS = """
+<Order>
+    <Item><ItemType>0</ItemType><ItemNo>12</ItemNo><ItemName>COLA</ItemName><Qty>1</Qty><Value>2.50</Value></Item>
+    <Item><ItemType>0</ItemType><ItemNo>12</ItemNo><ItemName>VD:COLA</ItemName><Qty>-1</Qty><Value>-2.50</Value></Item>
+    <Item><ItemType>2</ItemType><ItemNo>0</ItemNo><ItemName>NOTE</ItemName><Qty>0</Qty><Value>0.00</Value></Item>
+    <Item><ItemType>1</ItemType><ItemNo>3</ItemNo><ItemName>CASH</ItemName><Qty>1</Qty><Value>5.00</Value>
+          <Options>0001</Options><FuncNo>2</FuncNo></Item>
+    <Item><ItemType>2</ItemType><ItemNo>0</ItemNo><ItemName>CHANGE</ItemName><Qty>0</Qty><Value>2.50</Value></Item>
+</Order>
+"""
+
+
+def get_order_lines():
+    """
+    :return: list of order line rows prepared for COPY
+    """
+    items = [ItemData(item) for item in ET.fromstring(ORDER_ITEMS).findall("Item")]
+
+    return list(prepare_order_lines(items))
+
+
+def test_prepare_order_lines_skips_text_items():
+    """
+    Checks that only PLU, PLU 2nd, Free Function and Fixed Totalizer items become order lines
+
+    :assert: line numbers of PLU, VOIDed PLU and CASH items
+    """
+    line_numbers = [line[0] for line in get_order_lines()]
+
+    assert line_numbers == [0, 1, 3]
+
+
+def test_prepare_order_lines_void():
+    """
+    Checks that VOIDed item is bound to VOID free function
+
+    :assert: special free function name of the VOIDed item must be VOID
+    """
+    void_line = get_order_lines()[1]
+
+    assert void_line[8] == "VOID"
+
+
+def test_prepare_order_lines_cash_change():
+    """
+    Checks that CHANGE text item following CASH free function becomes its change
+    and in-drawer fixed totalizer number is calculated from options
+
+    :assert: change value and fixed totalizer number of CASH item
+    """
+    cash_line = get_order_lines()[2]
+
+    assert cash_line[7] == 2.5
+    assert cash_line[9] == 4
+
+
+def test_item_data_typed_values():
+    """
+    Checks that item values are converted at parse time
+
+    :assert: item type, number and quantity are ints, value is kept in cents
+    """
+    items = [ItemData(item) for item in ET.fromstring(ORDER_ITEMS).findall("Item")]
+    void_item = items[1]
+
+    assert (void_item.item_type, void_item.item_number, void_item.qty) == (0, 12, -1)
+    assert void_item.value_cents == -250
+    assert void_item.value == -2.5
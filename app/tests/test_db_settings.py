@@ -0,0 +1,96 @@
+import pytest
+from flask_login import login_user
+from sqlalchemy.exc import OperationalError
+
+from app import app, db
+from app.db_routing import QUERY_CANCELED_PGCODE
+from app.mod_stats.controllers import handle_operational_error
+from app.models import Order, Organization, User
+
+
+class DriverError(Exception):
+    """Error of database driver with PostgreSQL error code (as psycopg2 errors)"""
+    def __init__(self, pgcode):
+        super(DriverError, self).__init__("driver error")
+        self.pgcode = pgcode
+
+
+@pytest.fixture
+def sqlite_bind(tmpdir, monkeypatch):
+    """
+    :return: key of SQLite bind
+    """
+    monkeypatch.setitem(app.config, "SQLALCHEMY_BINDS", {"sqlite_file": "sqlite:///" + str(tmpdir.join("db.sqlite"))})
+
+    return "sqlite_file"
+
+
+def test_pool_pre_ping(sqlite_bind):
+    """
+    Checks that engines are created with SQLALCHEMY_POOL_PRE_PING option
+
+    :param sqlite_bind: fixture object
+    :assert: pool of the engine checks connections before use
+    """
+    engine = db.get_engine(app, bind=sqlite_bind)
+
+    assert engine.pool._pre_ping == app.config["SQLALCHEMY_POOL_PRE_PING"]
+
+
+@pytest.mark.parametrize("path, blueprint", [("/dashboard/1/today", "stats"), ("/login/", "auth")])
+def test_blueprint_statement_timeout(path, blueprint):
+    """
+    Checks that statement timeout of request is taken from STATEMENT_TIMEOUTS of its blueprint
+
+    :param path: URL path of the request
+    :param blueprint: name of blueprint handling the path
+    :assert: statement timeout of the session equals the blueprint's timeout
+    """
+    with app.test_request_context(path):
+        app.preprocess_request()
+
+        assert db.session.info["statement_timeout"] == app.config["STATEMENT_TIMEOUTS"][blueprint]
+
+    db.session.remove()
+
+
+def test_statement_timeout_page():
+    """
+    Checks that statistics query cancelled by statement timeout shows "range too large" message
+
+    :assert: response has 503 status and the message
+    """
+    error = OperationalError("SELECT 1", {}, DriverError(QUERY_CANCELED_PGCODE))
+
+    with app.test_request_context("/dashboard/1/this_quarter"):
+        # page content is shown to logged in users only
+        login_user(User(id=1, email="user@example.com"))
+        body, status = handle_operational_error(error)
+
+    assert status == 503
+    assert "date range is too large" in body
+
+
+def test_connection_error_message():
+    """
+    Checks that other database errors show connection error message
+
+    :assert: connection error message is returned
+    """
+    error = OperationalError("SELECT 1", {}, DriverError(None))
+
+    with app.test_request_context("/dashboard/1/today"):
+        assert handle_operational_error(error) == "No connection with database"
+
+
+def test_organization_deleted_by_database():
+    """
+    Checks that children of organization are deleted by ondelete="CASCADE" foreign keys, not loaded by the ORM
+
+    :assert: cascading relationships of Organization and Order.items have passive_deletes
+    """
+    relationships = [rel for rel in Organization.__mapper__.relationships
+                     if rel.cascade.delete or rel.secondary is not None]
+    relationships.append(Order.items.property)
+
+    assert all(rel.passive_deletes for rel in relationships)
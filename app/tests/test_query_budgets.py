@@ -0,0 +1,184 @@
+import datetime
+
+import pytest
+from app import app, db
+from app.mod_stats.stats_utils import StatsDataExtractor
+from app.models import Order, Organization
+from app.performance import QueryCounter
+
+
+ORG_ID = 16
+ORDER_ID = 400
+
+# a statement executed more times than this (with any parameters) is treated as N+1 queries
+MAX_STATEMENT_REPEATS = 2
+
+# StatsDataExtractor method: max number of SQL statements (orderlines of the period are loaded once)
+METHOD_BUDGETS = {
+    "get_department_sales_data": 1,
+    "get_fixed_totalizers": 1,
+    "get_plu_sales_data": 1,
+    "get_last_100_sales": 3,
+    "get_clerks_breakdown": 1,
+    "get_group_sales_data": 1,
+    "get_free_func": 1,
+    "calculate_change": 1,
+    "calculate_total_sales": 1,
+}
+
+# view endpoint: max number of SQL statements of one request
+# (user with organizations is loaded by one query and reused by the view)
+VIEW_BUDGETS = {
+    "stats.show_custom_datetime": 4,
+    "stats.get_order_details": 3,
+}
+
+
+def create_order():
+    """
+    Creates order object
+
+    :return: order object, start_datetime, end_datetime
+    """
+    order = Order.query.filter_by(id=ORDER_ID).first()
+    start_datetime = order.date_time
+    end_datetime = order.date_time
+
+    return order, start_datetime, end_datetime
+
+
+def check_statements(counter, budget):
+    """
+    :param counter: QueryCounter object
+    :param budget: max number of statements
+    :assert: number of statements is within the budget and no statement repeats more than MAX_STATEMENT_REPEATS
+    """
+    repeated = counter.get_repeated_statements(MAX_STATEMENT_REPEATS)
+
+    assert counter.count <= budget, "%s statements executed, budget is %s" % (counter.count, budget)
+    assert not repeated, "repeated statements: %s" % repeated
+
+
+@pytest.fixture
+def data_handler():
+    """
+    StatsDataExtractor for the whole day of the order, created with empty session
+    so objects loaded by previous tests don't hide lazy loads
+
+    :return: StatsDataExtractor object
+    """
+    db.session.remove()
+    order, start_datetime, end_datetime = create_order()
+    start_datetime = start_datetime.replace(hour=0, minute=0, second=0)
+    end_datetime = end_datetime.replace(hour=23, minute=59, second=59)
+
+    return StatsDataExtractor(ORG_ID, start_datetime, end_datetime)
+
+
+@pytest.fixture
+def client():
+    """
+    Test client with logged in user of the organization
+
+    :return: FlaskClient object
+    """
+    organization = Organization.query.filter_by(id=ORG_ID).first()
+    if not organization.users:
+        pytest.skip("organization has no users")
+
+    user_id = organization.users[0].id
+    db.session.remove()
+
+    app.config["TESTING"] = True
+    app.config["WTF_CSRF_ENABLED"] = False
+    test_client = app.test_client()
+
+    # log in without password: Flask-Login keeps user ID in session
+    with test_client.session_transaction() as session:
+        session["user_id"] = str(user_id)
+        session["_fresh"] = True
+
+    return test_client
+
+
+@pytest.mark.parametrize("method_name", sorted(METHOD_BUDGETS))
+def test_stats_method_query_budget(data_handler, method_name):
+    """
+    Checks number of SQL statements of StatsDataExtractor method
+
+    :param data_handler: fixture object
+    :param method_name: name of StatsDataExtractor method
+    :assert: statements are within METHOD_BUDGETS and none is repeated more than MAX_STATEMENT_REPEATS times
+    """
+    with QueryCounter(db.engine, keep_statements=True) as counter:
+        getattr(data_handler, method_name)()
+
+    check_statements(counter, METHOD_BUDGETS[method_name])
+
+
+def test_stats_methods_share_orderlines(data_handler):
+    """
+    Checks that orderlines are loaded once for all methods of one StatsDataExtractor (as in dashboard view)
+
+    :param data_handler: fixture object
+    :assert: statements of all methods are within one orderlines query plus get_last_100_sales budget
+    """
+    with QueryCounter(db.engine, keep_statements=True) as counter:
+        for method_name in sorted(METHOD_BUDGETS):
+            getattr(data_handler, method_name)()
+
+    check_statements(counter, 1 + METHOD_BUDGETS["get_last_100_sales"])
+
+
+def test_dashboard_view_query_budget(client):
+    """
+    Checks number of SQL statements of dashboard page for the day of the order
+
+    :param client: fixture object
+    :assert: statements are within VIEW_BUDGETS and none is repeated more than MAX_STATEMENT_REPEATS times
+    """
+    order, start_datetime, end_datetime = create_order()
+    start_date = start_datetime.date()
+    end_date = start_date + datetime.timedelta(days=1)
+    db.session.remove()
+
+    with QueryCounter(db.engine, keep_statements=True) as counter:
+        response = client.get("/dashboard/%s/%s_%s" % (ORG_ID, start_date, end_date))
+
+    assert response.status_code == 200
+    check_statements(counter, VIEW_BUDGETS["stats.show_custom_datetime"])
+
+
+def test_order_details_view_query_budget(client):
+    """
+    Checks number of SQL statements of order details page
+
+    :param client: fixture object
+    :assert: statements are within VIEW_BUDGETS and none is repeated more than MAX_STATEMENT_REPEATS times
+    """
+    with QueryCounter(db.engine, keep_statements=True) as counter:
+        response = client.get("/dashboard/%s/sale_%s" % (ORG_ID, ORDER_ID))
+
+    assert response.status_code == 200
+    check_statements(counter, VIEW_BUDGETS["stats.get_order_details"])
+
+
+def test_dashboard_of_other_organization(client):
+    """
+    Checks that user can't see statistics of organization which is not assigned to the user
+
+    :param client: fixture object
+    :assert: dashboard and order details pages of the organization return 404
+    """
+    with client.session_transaction() as session:
+        user_id = int(session["user_id"])
+
+    organization = Organization.query.filter(~Organization.users.any(id=user_id)).first()
+    if organization is None:
+        pytest.skip("user is assigned to all organizations")
+
+    org_id = organization.id
+    db.session.remove()
+
+    assert client.get("/dashboard/%s/today" % org_id).status_code == 404
+    assert client.get("/dashboard/%s/sale_%s" % (org_id, ORDER_ID)).status_code == 404
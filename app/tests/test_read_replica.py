@@ -0,0 +1,107 @@
+import datetime
+
+import pytest
+from app import app, db
+from app.models import Order
+
+
+REPLICA_BIND = "replica"
+
+
+@pytest.fixture
+def replica(tmpdir, monkeypatch):
+    """
+    SQLite file used as replica bind of statistics
+
+    :return: URL of replica database
+    """
+    replica_uri = "sqlite:///" + str(tmpdir.join("replica.db"))
+    monkeypatch.setitem(app.config, "SQLALCHEMY_BINDS", {REPLICA_BIND: replica_uri})
+    monkeypatch.setitem(app.config, "STATS_READ_BIND", REPLICA_BIND)
+    db.session.remove()
+
+    yield replica_uri
+
+    db.session.remove()
+
+
+def set_lag(monkeypatch, lag):
+    monkeypatch.setattr(db, "get_replication_lag", lambda bind_key: lag)
+
+
+def get_order_bind_url():
+    return str(db.session.get_bind(Order.__mapper__).url)
+
+
+def test_read_from_replica(replica):
+    """
+    Checks that queries inside read_from block use replica, and primary database outside of it
+
+    :param replica: fixture object
+    :assert: bind of Order model is replica inside the block and primary database after it
+    """
+    with db.read_from(REPLICA_BIND):
+        assert get_order_bind_url() == replica
+
+    assert get_order_bind_url() == app.config["SQLALCHEMY_DATABASE_URI"]
+
+
+def test_replica_not_configured(monkeypatch):
+    """
+    Checks that statistics are read from primary database if STATS_READ_BIND is not set
+
+    :assert: get_stats_read_bind returns None
+    """
+    monkeypatch.setitem(app.config, "STATS_READ_BIND", None)
+
+    assert db.get_stats_read_bind(datetime.datetime.utcnow()) is None
+
+
+def test_replica_within_lag(replica, monkeypatch):
+    """
+    Checks that "today" statistics are read from replica with small replication lag
+
+    :param replica: fixture object
+    :assert: get_stats_read_bind returns replica bind
+    """
+    set_lag(monkeypatch, app.config["REPLICA_MAX_LAG"] - 1)
+
+    assert db.get_stats_read_bind(datetime.datetime.utcnow()) == REPLICA_BIND
+
+
+def test_lagging_replica_today(replica, monkeypatch):
+    """
+    Checks that "today" statistics fall back to primary database if replica lags behind
+
+    :param replica: fixture object
+    :assert: get_stats_read_bind returns None
+    """
+    set_lag(monkeypatch, app.config["REPLICA_MAX_LAG"] + 3600)
+
+    assert db.get_stats_read_bind(datetime.datetime.utcnow()) is None
+
+
+def test_lagging_replica_past_period(replica, monkeypatch):
+    """
+    Checks that periods which ended before the lag are read from replica even if it lags behind
+
+    :param replica: fixture object
+    :assert: get_stats_read_bind returns replica bind for datetime and custom period string
+    """
+    set_lag(monkeypatch, app.config["REPLICA_MAX_LAG"] + 3600)
+    two_days_ago = datetime.datetime.utcnow() - datetime.timedelta(days=2)
+
+    assert db.get_stats_read_bind(two_days_ago) == REPLICA_BIND
+    assert db.get_stats_read_bind(two_days_ago.strftime("%Y-%m-%d")) == REPLICA_BIND
+
+
+def test_unavailable_replica(replica, monkeypatch):
+    """
+    Checks that statistics are read from primary database if replica is not available
+
+    :param replica: fixture object
+    :assert: get_stats_read_bind returns None
+    """
+    set_lag(monkeypatch, None)
+
+    assert db.get_stats_read_bind(datetime.datetime.utcnow() - datetime.timedelta(days=2)) is None
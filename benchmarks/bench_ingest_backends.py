@@ -0,0 +1,80 @@
+"""
+Benchmark of order ingest backends (ORM row by row inserts vs PostgreSQL COPY)
+
+Generates organization directory with master files and order files (benchmarks/data_generator.py), ingests it
+into a temporary organization with each backend and reports time and rows per second.
+Temporary organizations are deleted afterwards.
+
+Usage (from repository root, database must be PostgreSQL):
+    python -m benchmarks.bench_ingest_backends --orders 2000 --database-uri postgresql://...
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+
+from app import app, db
+from app.models import Organization, Order, OrderLine
+from benchmarks.data_generator import generate_org
+from db_update import DBInsert
+
+
+def ingest(org_path, backend):
+    """
+    Ingest organization directory with given backend into temporary organization
+    :return: tuple (seconds, inserted orders, inserted order lines)
+    """
+    org = Organization(name="bench_{}_{}".format(backend, os.getpid()), data_dir=org_path)
+    db.session.add(org)
+    db.session.commit()
+    org_id = org.id
+
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            db_insert = DBInsert(org_path, org_id, full_rescan=True)
+            db_insert.insert_master_data()
+
+            start_time = time.time()
+            db_insert.insert_order_data(ingest_backend=backend)
+            elapsed = time.time() - start_time
+
+        orders = Order.query.filter_by(org_id=org_id).count()
+        order_lines = OrderLine.query.join(OrderLine.order).filter(Order.org_id == org_id).count()
+    finally:
+        db.session.rollback()
+        Organization.query.filter_by(id=org_id).delete()
+        db.session.commit()
+
+    return elapsed, orders, order_lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ORM and COPY order ingest backends")
+    parser.add_argument("--orders", type=int, default=2000, help="Number of generated order files")
+    parser.add_argument("--items", type=int, default=10, help="Average number of products in each order")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of generated data")
+    parser.add_argument("--database-uri", default=app.config["SQLALCHEMY_DATABASE_URI"],
+                        help="PostgreSQL database used for benchmark")
+    args = parser.parse_args()
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.database_uri
+    db.create_all()
+
+    tmp_dir = tempfile.mkdtemp()
+    org_path = os.path.join(tmp_dir, "org")
+
+    try:
+        generate_org(org_path, orders_per_day=args.orders, items_per_order=args.items, seed=args.seed)
+
+        for backend in ("orm", "copy"):
+            elapsed, orders, order_lines = ingest(org_path, backend)
+            print("{:<5} {:>8} orders {:>9} order lines {:>8.2f} s {:>10.1f} rows/s".format(
+                backend, orders, order_lines, elapsed, (orders + order_lines) / elapsed if elapsed else 0))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
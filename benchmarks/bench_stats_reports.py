@@ -0,0 +1,258 @@
+"""
+Benchmark of StatsDataExtractor reports (app/mod_stats/stats_utils.py)
+
+"run" loads generated datasets (benchmarks/data_generator.py) of given sizes into the database,
+with orders from the start of this quarter until today, then times every StatsDataExtractor method
+for today, this month and this quarter ranges. Time (best of --repeat runs), number of SQL queries
+and peak Python memory (tracemalloc) are saved to a JSON file.
+Loaded datasets are kept in organizations named bench_stats_<size>_<seed>_<date> and reused by next runs,
+--drop deletes them afterwards.
+
+"compare" prints differences between two JSON files and exits with status 1 if a report got slower
+than the threshold or runs more queries.
+
+Usage (from repository root, database must be PostgreSQL):
+    python -m benchmarks.bench_stats_reports run --sizes 10000 100000 1000000 --output baseline.json
+    python -m benchmarks.bench_stats_reports run --sizes 10000 --output current.json
+    python -m benchmarks.bench_stats_reports compare baseline.json current.json --threshold 10
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app import app, db
+from app.models import Organization, Order, OrderLine
+from app.mod_stats.stats_utils import StatsDataExtractor, calc_today_timeframe, calc_this_month_timeframe, \
+    calc_this_quarter_timeframe
+from app.performance import QueryCounter
+from benchmarks.data_generator import generate_org
+from db_update import DBInsert
+
+
+# method: keyword arguments
+STATS_METHODS = {
+    "get_department_sales_data": {},
+    "get_fixed_totalizers": {},
+    "get_plu_sales_data": {},
+    "get_last_100_sales": {},
+    "get_clerks_breakdown": {},
+    "get_group_sales_data": {},
+    "get_free_func": {},
+    "calculate_change": {},
+    "calculate_total_sales": {},
+}
+# methods called by dashboard view with one StatsDataExtractor, measured together as "dashboard"
+DASHBOARD_METHODS = ("get_department_sales_data", "get_fixed_totalizers", "get_plu_sales_data", "get_last_100_sales",
+                     "get_clerks_breakdown", "get_group_sales_data", "get_free_func")
+TIMEFRAMES = {
+    "today": calc_today_timeframe,
+    "month": calc_this_month_timeframe,
+    "quarter": calc_this_quarter_timeframe,
+}
+ITEMS_PER_ORDER = 5
+
+
+def get_org_name(size, seed, today):
+    return "bench_stats_{}_{}_{:%Y%m%d}".format(size, seed, today)
+
+
+def load_dataset(size, seed, parse_workers):
+    """
+    Generate and ingest organization with about <size> order lines, from the start of this quarter until today
+    Organization loaded by a previous run on the same day is reused
+
+    :return: tuple (organization ID, number of order lines)
+    """
+    quarter_start = calc_this_quarter_timeframe()[0].date()
+    today = datetime.datetime.utcnow().date()
+    name = get_org_name(size, seed, today)
+
+    org = Organization.query.filter_by(name=name).first()
+
+    if org is None:
+        days = (today - quarter_start).days + 1
+        # a generated order gives about ITEMS_PER_ORDER products and a tender
+        orders_per_day = max(1, math.ceil(size / days / (ITEMS_PER_ORDER + 1)))
+
+        tmp_dir = tempfile.mkdtemp()
+        org_path = os.path.join(tmp_dir, "org")
+
+        try:
+            generate_org(org_path, orders_per_day=orders_per_day, days=days, items_per_order=ITEMS_PER_ORDER,
+                         start_date=quarter_start, seed=seed)
+
+            org = Organization(name=name, data_dir=org_path)
+            db.session.add(org)
+            db.session.commit()
+
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    db_insert = DBInsert(org_path, org.id, full_rescan=True)
+                    db_insert.insert_master_data()
+                    db_insert.insert_order_data(parse_workers=parse_workers, ingest_backend="copy")
+            except Exception:
+                # partly loaded dataset must not be reused
+                db.session.rollback()
+                Organization.query.filter_by(id=org.id).delete()
+                db.session.commit()
+                raise
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    order_lines = OrderLine.query.join(OrderLine.order).filter(Order.org_id == org.id).count()
+
+    return org.id, order_lines
+
+
+def call_methods(org_id, timeframe, method_names):
+    """Call methods of one StatsDataExtractor, starting with empty session"""
+    db.session.remove()
+    start_time, end_time = timeframe
+    data_handler = StatsDataExtractor(org_id, start_time, end_time)
+
+    for method_name in method_names:
+        getattr(data_handler, method_name)(**STATS_METHODS[method_name])
+
+
+def measure(org_id, timeframe, method_names, repeat):
+    """
+    :return: dictionary {"seconds": best time, "queries": number of SQL queries, "peak_mb": peak Python memory}
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        call_methods(org_id, timeframe, method_names)
+        timings.append(time.time() - start)
+
+    # memory is traced in a separate run, tracing slows the code down
+    tracemalloc.start()
+    with QueryCounter(db.engine) as counter:
+        call_methods(org_id, timeframe, method_names)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"seconds": round(min(timings), 4), "queries": counter.count, "peak_mb": round(peak / 1024 / 1024, 2)}
+
+
+def run(args):
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.database_uri
+    db.create_all()
+
+    results = {}
+    org_ids = []
+
+    try:
+        for size in args.sizes:
+            org_id, order_lines = load_dataset(size, args.seed, args.parse_workers)
+            org_ids.append(org_id)
+            dataset = {"order_lines": order_lines, "ranges": {}}
+            results[str(size)] = dataset
+
+            for range_name, calc_timeframe in TIMEFRAMES.items():
+                timeframe = calc_timeframe()
+                reports = {}
+                dataset["ranges"][range_name] = reports
+
+                for method_name in list(STATS_METHODS) + ["dashboard"]:
+                    method_names = DASHBOARD_METHODS if method_name == "dashboard" else (method_name,)
+                    reports[method_name] = measure(org_id, timeframe, method_names, args.repeat)
+
+                    print("{:>8} lines {:<8} {:<26} {:>9.4f} s {:>6} queries {:>9.2f} MB".format(
+                        order_lines, range_name, method_name, reports[method_name]["seconds"],
+                        reports[method_name]["queries"], reports[method_name]["peak_mb"]))
+    finally:
+        if args.drop:
+            db.session.rollback()
+            Organization.query.filter(Organization.id.in_(org_ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+    with open(args.output, "w") as f:
+        json.dump({"created": datetime.datetime.utcnow().isoformat(), "seed": args.seed, "repeat": args.repeat,
+                   "results": results}, f, indent=2, sort_keys=True)
+
+
+def flatten_results(data):
+    """
+    :param data: content of JSON file written by "run"
+    :return: dictionary {(size, range, method): measured values}
+    """
+    values = {}
+
+    for size, dataset in data["results"].items():
+        for range_name, reports in dataset["ranges"].items():
+            for method_name, report in reports.items():
+                values[(size, range_name, method_name)] = report
+
+    return values
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = flatten_results(json.load(f))
+    with open(args.current) as f:
+        current = flatten_results(json.load(f))
+
+    regressions = 0
+
+    for key in sorted(set(baseline) & set(current), key=lambda key: (int(key[0]), key[1], key[2])):
+        before = baseline[key]
+        after = current[key]
+        change = (after["seconds"] - before["seconds"]) / before["seconds"] * 100 if before["seconds"] else 0
+
+        regression = change > args.threshold or after["queries"] > before["queries"]
+        regressions += regression
+
+        line = "{:>8} {:<8} {:<26} {:>9.4f} -> {:>9.4f} s {:>+7.1f}% {:>5} -> {:>5} queries {:>8.2f} -> {:>8.2f} MB"
+        line = line.format(key[0], key[1], key[2], before["seconds"], after["seconds"], change,
+                           before["queries"], after["queries"], before["peak_mb"], after["peak_mb"])
+        print(line + " REGRESSION" if regression else line)
+
+    for key in sorted(set(baseline) ^ set(current)):
+        print("{:>8} {:<8} {:<26} only in {}".format(
+            key[0], key[1], key[2], args.baseline if key in baseline else args.current))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark StatsDataExtractor reports")
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="Load datasets, measure reports and save results to JSON file")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                            help="Number of order lines of each dataset")
+    run_parser.add_argument("--output", default="stats_bench.json", help="JSON file with results")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Best of N runs is reported")
+    run_parser.add_argument("--seed", type=int, default=0, help="Random seed of generated data")
+    run_parser.add_argument("--parse-workers", type=int, default=1, help="Processes parsing order files on load")
+    run_parser.add_argument("--drop", action="store_true", help="Delete loaded datasets afterwards")
+    run_parser.add_argument("--database-uri", default=app.config["SQLALCHEMY_DATABASE_URI"],
+                            help="PostgreSQL database used for benchmark")
+
+    compare_parser = commands.add_parser("compare", help="Compare results with baseline")
+    compare_parser.add_argument("baseline", help="JSON file with baseline results")
+    compare_parser.add_argument("current", help="JSON file with current results")
+    compare_parser.add_argument("--threshold", type=float, default=10,
+                                help="Slowdown in percent reported as regression")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        if compare(args):
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Speed benchmark for XML parser backends (see XML_BACKENDS in app/mod_db_manage/utils.py)
+
+Generates master files and many small order files (benchmarks/data_generator.py) and measures time needed
+to get all records and items with each available backend, in tree and streaming modes.
+
+Usage (from repository root):
+    python -m benchmarks.bench_xml_backends --orders 2000 --plus 20000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from app.mod_db_manage import utils
+from app.mod_db_manage.xml_parser import MasterFilesScanner, get_orders_gen
+from benchmarks.data_generator import generate_org
+
+
+def read_master_files(org_path):
+    return sum(1 for _ in MasterFilesScanner(org_path).iter_records())
+
+
+def read_orders(org_path):
+    return sum(len(list(order.items)) for order in get_orders_gen(org_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare XML parser backends")
+    parser.add_argument("--orders", type=int, default=2000, help="Number of generated order files")
+    parser.add_argument("--items", type=int, default=20, help="Average number of products in each order file")
+    parser.add_argument("--plus", type=int, default=20000, help="Number of PLU master file records")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of generated data")
+    parser.add_argument("--repeat", type=int, default=3, help="Best of N runs is reported")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    org_path = os.path.join(tmp_dir, "org")
+
+    try:
+        generate_org(org_path, plus=args.plus, orders_per_day=args.orders, items_per_order=args.items,
+                     seed=args.seed)
+
+        for backend in sorted(utils.XML_BACKENDS):
+            utils.set_xml_backend(backend)
+
+            for mode, min_size in (("tree", None), ("stream", 0)):
+                utils.XML_STREAMING_MIN_SIZE = min_size
+
+                for name, func in (("master files", read_master_files), ("orders", read_orders)):
+                    timings = []
+                    for _ in range(args.repeat):
+                        start = time.time()
+                        count = func(org_path)
+                        timings.append(time.time() - start)
+
+                    print("{:<6} {:<7} {:<13} {:>9} rows {:>8.3f} s".format(
+                        backend, mode, name, count, min(timings)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Memory benchmark for XML parsing modes (whole tree vs streaming)
+
+Generates big PLU master file and big order file and measures peak memory (tracemalloc)
+needed to go through all records / items in each mode.
+
+Usage (from repository root):
+    python -m benchmarks.bench_xml_memory --size 100
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from app.mod_db_manage import utils
+from app.mod_db_manage.xml_parser import MasterFilesScanner, get_orders_gen
+
+
+PLU_RECORD = ("<Record><Number>{0}</Number><Name>PLU {0}</Name><GroupNo>1</GroupNo><DepartmentNo>1</DepartmentNo>"
+              "<Price>1.50</Price><TaxNo>1</TaxNo><MixMatch>0</MixMatch></Record>\n")
+ORDER_ITEM = ("<Item><ItemType>0</ItemType><ItemNo>{0}</ItemNo><ItemName>PLU {0}</ItemName><Qty>1</Qty>"
+              "<Value>1.50</Value></Item>\n")
+
+
+def write_big_file(path, header, footer, line_template, size_mb):
+    """Write XML file with repeated line until it reaches size_mb megabytes"""
+    limit = size_mb * 1024 * 1024
+    written = 0
+    number = 0
+
+    with open(path, "w") as f:
+        f.write(header)
+
+        while written < limit:
+            line = line_template.format(number)
+            f.write(line)
+            written += len(line)
+            number += 1
+
+        f.write(footer)
+
+    return number
+
+
+def generate_files(org_path, size_mb):
+    """Create organization directory with one big master file and one big order file"""
+    group_path = os.path.join(org_path, "Group 1")
+    mf_path = os.path.join(group_path, "Master Files")
+    os.makedirs(mf_path)
+
+    records = write_big_file(os.path.join(mf_path, "PLU.xml"),
+                             "<MasterFile><Name>PLU</Name><Date>01/01/2018</Date><Time>00:00</Time><Records>\n",
+                             "</Records></MasterFile>\n",
+                             PLU_RECORD, size_mb)
+    items = write_big_file(os.path.join(group_path, "Order_1.xml"),
+                           "<Order><Date>01/01/2018</Date><Time>00:00:00</Time><Mode>REG</Mode>"
+                           "<ConsecutiveNo>1</ConsecutiveNo><TerminalNo>1</TerminalNo><TerminalName>T1</TerminalName>"
+                           "<ClerkNo>1</ClerkNo><TableNo>0</TableNo>\n",
+                           "</Order>\n",
+                           ORDER_ITEM, size_mb)
+
+    return records, items
+
+
+def consume_master_files(org_path):
+    count = 0
+    for _ in MasterFilesScanner(org_path).get_records("PLU"):
+        count += 1
+    return count
+
+
+def consume_orders(org_path):
+    count = 0
+    for order in get_orders_gen(org_path):
+        for _ in order.items:
+            count += 1
+    return count
+
+
+def measure(func, org_path):
+    """Run function and return (result, seconds, peak memory in MB)"""
+    tracemalloc.start()
+    start = time.time()
+    result = func(org_path)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory usage of tree and streaming XML parsing")
+    parser.add_argument("--size", type=int, default=100, help="Size of each generated file in MB")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    org_path = os.path.join(tmp_dir, "org")
+
+    try:
+        records, items = generate_files(org_path, args.size)
+        print("Generated {} PLU records and {} order items ({} MB each)".format(records, items, args.size))
+
+        for mode, min_size in (("tree", None), ("stream", 0)):
+            utils.XML_STREAMING_MIN_SIZE = min_size
+
+            for name, func in (("master files", consume_master_files), ("orders", consume_orders)):
+                count, elapsed, peak = measure(func, org_path)
+                print("{:<7} {:<13} {:>9} rows {:>8.2f} s  peak {:>9.2f} MB".format(
+                    mode, name, count, elapsed, peak))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Synthetic POS data generator
+
+Writes organization directories in the layout read by app/mod_db_manage/xml_parser.py:
+
+    <output>/Org 1/Group 1/Master Files/<Fixed Totaliser, Free Function, Group, Department, PLU, PLU 2nd,
+                                         Clerk, Customers, Tax table>.xml
+    <output>/Org 1/Group 1/Order_<date>_<number>.xml
+
+Orders have PLU and PLU 2nd items, VOIDed items, HOLD free functions and CASH (with CHANGE) or CARD tenders,
+some of them belong to a customer. The same seed always produces the same files.
+
+Usage (from repository root):
+    python -m benchmarks.data_generator /tmp/pos_data --orgs 2 --plus 500 --orders-per-day 300 --days 30
+"""
+import argparse
+import datetime
+import os
+import random
+
+
+MASTER_FILE_HEADER = "<MasterFile><Name>{name}</Name><Date>{date:%d/%m/%Y}</Date><Time>00:00</Time><Records>\n"
+MASTER_FILE_FOOTER = "</Records></MasterFile>\n"
+
+NAME_RECORD = "<Record><Number>{number}</Number><Name>{name}</Name></Record>\n"
+FREE_FUNCTION_RECORD = ("<Record><Number>{number}</Number><Name>{name}</Name>"
+                        "<FunctionNo>{function_number}</FunctionNo></Record>\n")
+DEPARTMENT_RECORD = "<Record><Number>{number}</Number><Name>{name}</Name><GroupNo>{group}</GroupNo></Record>\n"
+TAX_RECORD = "<Record><Number>{number}</Number><Name>{name}</Name><Rate>{rate}</Rate></Record>\n"
+PLU_RECORD = ("<Record><Number>{number}</Number><Name>{name}</Name><GroupNo>{group}</GroupNo>"
+              "<DepartmentNo>{department}</DepartmentNo><Price>{price:.2f}</Price><TaxNo>{tax}</TaxNo>"
+              "<MixMatch>0</MixMatch></Record>\n")
+CUSTOMER_RECORD = ("<Record><Number>{number}</Number><FirstName>{first_name}</FirstName><Surname>{surname}</Surname>"
+                   "<Address1>{number} High Street</Address1><Address2>Flat {flat}</Address2><Address3>London"
+                   "</Address3><Postcode>N{flat} {number}AB</Postcode><Telephone>0207{number:07d}</Telephone>"
+                   "<Email>customer{number}@example.com</Email><OverDraftLimit>{overdraft}.00</OverDraftLimit>"
+                   "<CustGroupNo>1</CustGroupNo></Record>\n")
+
+ORDER_HEADER = ("<Order><Date>{date_time:%d/%m/%Y}</Date><Time>{date_time:%H:%M:%S}</Time><Mode>REG</Mode>"
+                "<ConsecutiveNo>{number}</ConsecutiveNo><TerminalNo>{terminal}</TerminalNo>"
+                "<TerminalName>TILL {terminal}</TerminalName><ClerkNo>{clerk}</ClerkNo><TableNo>0</TableNo>\n")
+ORDER_CUSTOMER = "<Customer><CustomerID>{0}</CustomerID></Customer>\n"
+ORDER_FOOTER = "</Order>\n"
+ORDER_ITEM = ("<Item><ItemType>{item_type}</ItemType><ItemNo>{number}</ItemNo><ItemName>{name}</ItemName>"
+              "<Qty>{qty}</Qty><Value>{value:.2f}</Value></Item>\n")
+FREE_FUNCTION_ITEM = ("<Item><ItemType>1</ItemType><ItemNo>{number}</ItemNo><ItemName>{name}</ItemName>"
+                      "<Qty>{qty}</Qty><Value>{value:.2f}</Value><Options>{option}</Options>"
+                      "<FuncNo>{func_number}</FuncNo></Item>\n")
+
+# in-drawer fixed totalizers are found by free function option + MAGIC_INDRAWER_NUMBER (see db_update.py)
+FIXED_TOTALIZERS = ["NET 1", "NET 2", "GROSS", "CASH in drawer", "CHEQUE in drawer", "CARD in drawer",
+                    "CHARGE in drawer", "DISCOUNT", "REFUND", "VOID", "NO SALE", "PAID OUT"]
+# (number, name, function number in master file, FuncNo of order items, option of order items)
+FREE_FUNCTIONS = [(1, "CASH", "TENDER", 2, "0001"),
+                  (2, "CARD", "TENDER", 2, "0003"),
+                  (3, "VOID", "VOID", 10, "0000"),
+                  (4, "CANCEL", "CANCEL", 11, "0000"),
+                  (5, "HOLD", "HOLD", 12, "0000"),
+                  (6, "FREE TEXT", "FREE TEXT", 13, "0000"),
+                  (7, "DISCOUNT", "-%", 14, "0000")]
+CASH_FUNCTION = FREE_FUNCTIONS[0]
+CARD_FUNCTION = FREE_FUNCTIONS[1]
+HOLD_FUNCTION = FREE_FUNCTIONS[4]
+GROUPS = ["FOOD", "DRINKS", "BAR", "RETAIL"]
+DEPARTMENTS = [("HOT FOOD", 1), ("COLD FOOD", 1), ("DESSERTS", 1), ("HOT DRINKS", 2), ("SOFT DRINKS", 2),
+               ("BEER", 3), ("WINE", 3), ("SPIRITS", 3), ("GIFTS", 4)]
+TAXES = [("VAT A", 20), ("VAT B", 5), ("VAT Z", 0)]
+PRODUCTS = ["Sandwich", "Coffee", "Tea", "Burger", "Salad", "Soup", "Cake", "Juice", "Water", "Lager", "Cider",
+            "Wine", "Gin", "Crisps", "Muffin", "Pasta", "Pizza", "Chips", "Ice Cream", "Cola"]
+CLERK_NAMES = ["ANNA", "BEN", "CHLOE", "DAN", "EMMA", "FRED", "GRACE", "HARRY", "IVY", "JACK"]
+FIRST_NAMES = ["Alice", "Bob", "Carol", "David", "Eve", "Frank", "Gina", "Henry"]
+SURNAMES = ["Smith", "Jones", "Brown", "Taylor", "Wilson", "Evans", "Thomas", "Roberts"]
+
+# orders are spread over trading hours
+OPENING_HOUR = 8
+CLOSING_HOUR = 22
+
+
+def write_master_file(mf_path, name, records, date):
+    with open(os.path.join(mf_path, name + ".xml"), "w") as f:
+        f.write(MASTER_FILE_HEADER.format(name=name, date=date))
+        f.writelines(records)
+        f.write(MASTER_FILE_FOOTER)
+
+
+def generate_products(rng, plus, plus_2nd):
+    """
+    :return: list of PLU and PLU 2nd products (dictionaries with values of PLU_RECORD), PLU 2nd are numbered after PLU
+    """
+    products = []
+
+    for number in range(1, plus + plus_2nd + 1):
+        department = rng.randrange(len(DEPARTMENTS))
+        products.append({
+            "number": number,
+            "name": "{} {}".format(rng.choice(PRODUCTS), number),
+            "group": DEPARTMENTS[department][1],
+            "department": department + 1,
+            "price": rng.randrange(10, 300) * 5 / 100,
+            "tax": rng.randint(1, len(TAXES)),
+        })
+
+    return products
+
+
+def write_master_files(mf_path, products, plus, clerks, customers, date):
+    """Write one master file of each data type"""
+    os.makedirs(mf_path)
+
+    write_master_file(mf_path, "Fixed Totaliser",
+                      [NAME_RECORD.format(number=number, name=name)
+                       for number, name in enumerate(FIXED_TOTALIZERS, 1)], date)
+    write_master_file(mf_path, "Free Function",
+                      [FREE_FUNCTION_RECORD.format(number=number, name=name, function_number=function_number)
+                       for number, name, function_number, _, _ in FREE_FUNCTIONS], date)
+    write_master_file(mf_path, "Group",
+                      [NAME_RECORD.format(number=number, name=name) for number, name in enumerate(GROUPS, 1)], date)
+    write_master_file(mf_path, "Department",
+                      [DEPARTMENT_RECORD.format(number=number, name=name, group=group)
+                       for number, (name, group) in enumerate(DEPARTMENTS, 1)], date)
+    write_master_file(mf_path, "Tax table",
+                      [TAX_RECORD.format(number=number, name=name, rate=rate)
+                       for number, (name, rate) in enumerate(TAXES, 1)], date)
+    write_master_file(mf_path, "PLU", [PLU_RECORD.format(**product) for product in products[:plus]], date)
+    write_master_file(mf_path, "PLU 2nd", [PLU_RECORD.format(**product) for product in products[plus:]], date)
+    write_master_file(mf_path, "Clerk",
+                      [NAME_RECORD.format(number=number, name=CLERK_NAMES[(number - 1) % len(CLERK_NAMES)])
+                       for number in range(1, clerks + 1)], date)
+    write_master_file(mf_path, "Customers",
+                      [CUSTOMER_RECORD.format(number=number, flat=number % 50 + 1, overdraft=number % 5 * 100,
+                                              first_name=FIRST_NAMES[number % len(FIRST_NAMES)],
+                                              surname=SURNAMES[number // len(FIRST_NAMES) % len(SURNAMES)])
+                       for number in range(1, customers + 1)], date)
+
+
+def generate_order_items(rng, products, plus, items_per_order, void_rate, hold_rate):
+    """
+    Generate items of one order: products, VOIDs and HOLDs, then tender (CASH with CHANGE or CARD)
+    :return: tuple (list of XML lines, number of lines ingested as order lines)
+    """
+    lines = []
+    total = 0
+
+    for _ in range(rng.randint(1, 2 * items_per_order - 1)):
+        product = rng.choice(products)
+        item_type = 0 if product["number"] <= plus else 3
+        qty = rng.choice((1, 1, 1, 1, 2, 2, 3))
+        value = product["price"] * qty
+        lines.append(ORDER_ITEM.format(item_type=item_type, number=product["number"], name=product["name"],
+                                       qty=qty, value=value))
+        total += value
+
+        # VOIDed item is repeated with "VD:" prefix and negative values
+        if rng.random() < void_rate:
+            lines.append(ORDER_ITEM.format(item_type=item_type, number=product["number"],
+                                           name="VD:" + product["name"], qty=-qty, value=-value))
+            total -= value
+
+    if rng.random() < hold_rate:
+        number, name, _, func_number, option = HOLD_FUNCTION
+        lines.append(FREE_FUNCTION_ITEM.format(number=number, name=name, qty=1, value=0,
+                                               option=option, func_number=func_number))
+
+    total = round(total, 2)
+
+    if rng.random() < 0.6:
+        # cash is rounded up to a note, rest is given back as change
+        number, name, _, func_number, option = CASH_FUNCTION
+        paid = total if rng.random() < 0.3 else (int(total) // 5 + 1) * 5
+        lines.append(FREE_FUNCTION_ITEM.format(number=number, name=name, qty=1, value=paid,
+                                               option=option, func_number=func_number))
+        lines.append(ORDER_ITEM.format(item_type=2, number=0, name="CHANGE", qty=0, value=paid - total))
+        order_lines = len(lines) - 1
+    else:
+        number, name, _, func_number, option = CARD_FUNCTION
+        lines.append(FREE_FUNCTION_ITEM.format(number=number, name=name, qty=1, value=total,
+                                               option=option, func_number=func_number))
+        order_lines = len(lines)
+
+    return lines, order_lines
+
+
+def generate_org(org_path, plus=200, plus_2nd=20, clerks=5, customers=50, groups=1, orders_per_day=100, days=1,
+                 items_per_order=5, start_date=datetime.date(2018, 1, 1), void_rate=0.03, hold_rate=0.02,
+                 customer_rate=0.1, seed=0):
+    """
+    Create organization directory with master files and order files
+    Orders of each day are shared by group directories (terminals), each group has its own copy of master files
+
+    :param org_path: path of organization directory, must not exist
+    :param plus: number of PLU products
+    :param plus_2nd: number of PLU 2nd products
+    :param clerks: number of clerks
+    :param customers: number of customers
+    :param groups: number of group directories
+    :param orders_per_day: number of orders of each day
+    :param days: number of days, starting at start_date
+    :param items_per_order: average number of products in order
+    :param start_date: date of first orders
+    :param void_rate: probability that a product is VOIDed
+    :param hold_rate: probability that order has a HOLD item
+    :param customer_rate: probability that order belongs to a customer
+    :param seed: random seed, the same seed gives the same files
+    :return: dictionary {"orders": number of order files, "order_lines": number of order lines they give}
+    """
+    rng = random.Random(seed)
+    products = generate_products(rng, plus, plus_2nd)
+    group_paths = [os.path.join(org_path, "Group {}".format(number)) for number in range(1, groups + 1)]
+
+    for group_path in group_paths:
+        write_master_files(os.path.join(group_path, "Master Files"), products, plus, clerks, customers, start_date)
+
+    orders = 0
+    order_lines = 0
+
+    for day in range(days):
+        date = start_date + datetime.timedelta(days=day)
+        opening_time = datetime.datetime.combine(date, datetime.time(OPENING_HOUR))
+        seconds = sorted(rng.randrange((CLOSING_HOUR - OPENING_HOUR) * 3600) for _ in range(orders_per_day))
+
+        for second in seconds:
+            orders += 1
+            terminal = rng.randint(1, groups)
+            lines, lines_count = generate_order_items(rng, products, plus, items_per_order, void_rate, hold_rate)
+            order_lines += lines_count
+
+            header = ORDER_HEADER.format(date_time=opening_time + datetime.timedelta(seconds=second),
+                                         number=orders, terminal=terminal, clerk=rng.randint(1, clerks))
+            if rng.random() < customer_rate:
+                header += ORDER_CUSTOMER.format(rng.randint(1, customers))
+
+            order_file = "Order_{:%Y%m%d}_{:07d}.xml".format(date, orders)
+            with open(os.path.join(group_paths[terminal - 1], order_file), "w") as f:
+                f.write(header)
+                f.writelines(lines)
+                f.write(ORDER_FOOTER)
+
+    return {"orders": orders, "order_lines": order_lines}
+
+
+def generate_dataset(output_path, orgs=1, seed=0, **org_options):
+    """
+    Create organization directories "Org 1", "Org 2" etc.
+    :param output_path: data directory, created if it does not exist
+    :param orgs: number of organizations
+    :param seed: random seed, each organization gets its own seed derived from it
+    :param org_options: options of generate_org
+    :return: dictionary {organization directory path: value returned by generate_org}
+    """
+    dataset = {}
+
+    for number in range(1, orgs + 1):
+        org_path = os.path.join(output_path, "Org {}".format(number))
+        dataset[org_path] = generate_org(org_path, seed=seed * 1000 + number, **org_options)
+
+    return dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic POS master and order XML files")
+    parser.add_argument("output", help="Data directory, organization directories are created in it")
+    parser.add_argument("--orgs", type=int, default=1, help="Number of organizations")
+    parser.add_argument("--groups", type=int, default=1, help="Number of group directories of each organization")
+    parser.add_argument("--plus", type=int, default=200, help="Number of PLU products")
+    parser.add_argument("--plus-2nd", type=int, default=20, help="Number of PLU 2nd products")
+    parser.add_argument("--clerks", type=int, default=5, help="Number of clerks")
+    parser.add_argument("--customers", type=int, default=50, help="Number of customers")
+    parser.add_argument("--orders-per-day", type=int, default=100, help="Number of orders of each day")
+    parser.add_argument("--days", type=int, default=1, help="Number of days")
+    parser.add_argument("--items", type=int, default=5, help="Average number of products in order")
+    parser.add_argument("--start-date", type=lambda value: datetime.datetime.strptime(value, "%Y-%m-%d").date(),
+                        default=datetime.date(2018, 1, 1), help="Date of first orders (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    dataset = generate_dataset(args.output, orgs=args.orgs, seed=args.seed, groups=args.groups, plus=args.plus,
+                               plus_2nd=args.plus_2nd, clerks=args.clerks, customers=args.customers,
+                               orders_per_day=args.orders_per_day, days=args.days, items_per_order=args.items,
+                               start_date=args.start_date)
+
+    for org_path, counts in sorted(dataset.items()):
+        print("{}: {} orders, {} order lines".format(org_path, counts["orders"], counts["order_lines"]))
+
+
+if __name__ == "__main__":
+    main()
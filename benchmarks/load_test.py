@@ -0,0 +1,287 @@
+"""
+HTTP load test of dashboard pages
+
+Serves the WSGI app with werkzeug in a background thread (single-threaded by default, like one sync worker),
+logs clients in through the login form of mod_auth and requests dashboard pages (today, this month,
+last quarter, custom range, order details) with given number of concurrent clients.
+Reports throughput and p50 / p95 / p99 latency of all requests and of each page.
+
+Data is generated (benchmarks/data_generator.py) from the start of last quarter until today and loaded into
+organization load_test_<orders per day>_<seed>_<date>, together with user loadtest@example.com.
+Both are reused by next runs on the same day, --drop deletes them afterwards.
+
+Usage (from repository root):
+    python -m benchmarks.load_test --clients 10 --requests 50 --orders-per-day 200
+"""
+import argparse
+import contextlib
+import datetime
+import http.cookiejar
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.serving import make_server
+
+from app import app, db
+from app.models import Organization, Order, User
+from app.mod_stats.stats_utils import calc_last_quarter_timeframe
+from benchmarks.data_generator import generate_org
+from db_update import DBInsert
+
+
+USER_EMAIL = "loadtest@example.com"
+USER_PASSWORD = "loadtest"
+CSRF_TOKEN_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"|value="([^"]+)" name="csrf_token"')
+# number of order details pages requested by clients (latest orders of the organization)
+ORDER_PAGES = 5
+
+
+def load_org(orders_per_day, seed, ingest_backend):
+    """
+    Generate and ingest organization with orders from the start of last quarter until today,
+    create load test user assigned to it. Organization loaded by a previous run on the same day is reused
+
+    :return: organization ID
+    """
+    start_date = calc_last_quarter_timeframe()[0].date()
+    today = datetime.datetime.utcnow().date()
+    name = "load_test_{}_{}_{:%Y%m%d}".format(orders_per_day, seed, today)
+
+    org = Organization.query.filter_by(name=name).first()
+
+    if org is None:
+        tmp_dir = tempfile.mkdtemp()
+        org_path = os.path.join(tmp_dir, "org")
+
+        try:
+            generate_org(org_path, orders_per_day=orders_per_day, days=(today - start_date).days + 1,
+                         start_date=start_date, seed=seed)
+
+            org = Organization(name=name, data_dir=org_path)
+            db.session.add(org)
+            db.session.commit()
+
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    db_insert = DBInsert(org_path, org.id, full_rescan=True)
+                    db_insert.insert_master_data()
+                    db_insert.insert_order_data(ingest_backend=ingest_backend)
+            except Exception:
+                # partly loaded organization must not be reused
+                db.session.rollback()
+                Organization.query.filter_by(id=org.id).delete()
+                db.session.commit()
+                raise
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    user = User.query.filter_by(email=USER_EMAIL).first()
+    if user is None:
+        user = User(username="loadtest", email=USER_EMAIL)
+        user.set_password(USER_PASSWORD)
+        db.session.add(user)
+
+    # the first organization of the user is shown after login
+    user.organizations = [org]
+    db.session.commit()
+
+    return org.id
+
+
+def get_pages(org_id):
+    """
+    :return: list of tuples (page name, URL path)
+    """
+    today = datetime.datetime.utcnow().date()
+    orders = Order.query.filter_by(org_id=org_id).order_by(Order.date_time.desc()).limit(ORDER_PAGES).all()
+
+    pages = [("today", "/dashboard/{}/today".format(org_id)),
+             ("this_month", "/dashboard/{}/this_month".format(org_id)),
+             ("last_quarter", "/dashboard/{}/last_quarter".format(org_id)),
+             ("custom_week", "/dashboard/{}/{}_{}".format(org_id, today - datetime.timedelta(days=7), today))]
+    pages.extend(("order_details", "/dashboard/{}/sale_{}".format(org_id, order.id)) for order in orders)
+
+    return pages
+
+
+class Client:
+    """Browser-like client (keeps session cookie) that logs in through the login form"""
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, path, data=None):
+        """
+        :return: tuple (HTTP status, response body)
+        """
+        if data is not None:
+            data = urllib.parse.urlencode(data).encode()
+
+        try:
+            with self.opener.open(self.base_url + path, data=data) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read().decode()
+
+    def login(self, email, password):
+        status, body = self.request("/login/")
+        match = CSRF_TOKEN_RE.search(body)
+        form = {"email": email, "password": password}
+        if match:
+            form["csrf_token"] = match.group(1) or match.group(2)
+
+        # successful login redirects to the dashboard, failed one shows login form again
+        status, body = self.request("/login/", form)
+        if status != 200 or 'name="password"' in body:
+            raise RuntimeError("Login failed (HTTP {})".format(status))
+
+
+def run_client(base_url, pages, requests, results):
+    """
+    Log in and request pages in turn
+    :param results: list of tuples (page name, seconds, HTTP status), appended to
+    """
+    client = Client(base_url)
+    client.login(USER_EMAIL, USER_PASSWORD)
+
+    for number in range(requests):
+        page_name, path = pages[number % len(pages)]
+
+        start = time.time()
+        status, _ = client.request(path)
+        results.append((page_name, time.time() - start, status))
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile
+    :param sorted_values: sorted list of numbers, not empty
+    :param percent: 0 - 100
+    """
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+
+    return sorted_values[rank - 1]
+
+
+def summarize(results, elapsed):
+    """
+    :param results: list of tuples (page name, seconds, HTTP status)
+    :param elapsed: wall-clock time of the test in seconds
+    :return: dictionary {"all" or page name: {"requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms"}}
+    """
+    pages = {"all": results}
+    for result in results:
+        pages.setdefault(result[0], []).append(result)
+
+    summary = {}
+    for page_name, page_results in pages.items():
+        latencies = sorted(seconds * 1000 for _, seconds, _ in page_results)
+        summary[page_name] = {
+            "requests": len(page_results),
+            "errors": sum(1 for _, _, status in page_results if status != 200),
+            "rps": round(len(page_results) / elapsed, 1) if elapsed else 0,
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+        }
+
+    return summary
+
+
+def run_load_test(pages, clients, requests, threaded):
+    """
+    Serve the app and run clients concurrently
+    :return: tuple (list of results, elapsed seconds)
+    """
+    # access log of every request would bury the report
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=threaded)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    base_url = "http://127.0.0.1:{}".format(server.server_port)
+
+    results = []
+    errors = []
+
+    def client_thread():
+        try:
+            run_client(base_url, pages, requests, results)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=client_thread) for _ in range(clients)]
+
+    try:
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        server.shutdown()
+
+    if errors:
+        raise errors[0]
+
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of dashboard pages")
+    parser.add_argument("--clients", type=int, default=10, help="Number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=50, help="Number of requests of each client")
+    parser.add_argument("--threaded", action="store_true",
+                        help="Handle each request in a new thread (single-threaded server by default)")
+    parser.add_argument("--orders-per-day", type=int, default=100, help="Orders of each day of generated data")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of generated data")
+    parser.add_argument("--database-uri", default=app.config["SQLALCHEMY_DATABASE_URI"],
+                        help="Database used for load test (COPY ingest is used for PostgreSQL)")
+    parser.add_argument("--output", help="Save summary to JSON file")
+    parser.add_argument("--drop", action="store_true", help="Delete loaded organization and user afterwards")
+    args = parser.parse_args()
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.database_uri
+    db.create_all()
+
+    ingest_backend = "copy" if args.database_uri.startswith("postgresql") else "orm"
+    org_id = load_org(args.orders_per_day, args.seed, ingest_backend)
+    pages = get_pages(org_id)
+    db.session.remove()
+
+    try:
+        results, elapsed = run_load_test(pages, args.clients, args.requests, args.threaded)
+    finally:
+        if args.drop:
+            db.session.rollback()
+            Organization.query.filter_by(id=org_id).delete()
+            User.query.filter_by(email=USER_EMAIL).delete()
+            db.session.commit()
+
+    summary = summarize(results, elapsed)
+
+    print("{} clients, {} requests in {:.2f} s".format(args.clients, len(results), elapsed))
+    for page_name in ["all"] + sorted(name for name in summary if name != "all"):
+        values = summary[page_name]
+        print("{:<14} {:>6} requests {:>4} errors {:>8.1f} req/s  p50 {:>8.1f} ms  p95 {:>8.1f} ms  "
+              "p99 {:>8.1f} ms".format(page_name, values["requests"], values["errors"], values["rps"],
+                                       values["p50_ms"], values["p95_ms"], values["p99_ms"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"clients": args.clients, "threaded": args.threaded, "elapsed": round(elapsed, 3),
+                       "pages": summary}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,31 @@
 Connects to database and adds new data from XML files
 """
 import argparse
+import cProfile
+import itertools
+import json
+import multiprocessing
+import pstats
+import sys
+import time
 import traceback
 
+from sqlalchemy.exc import OperationalError, InterfaceError
+
 from app import db
 from app.models import User, Organization, FixedTotalizer, FreeFunction, Department, Group, PLU, Tax, \
                         Clerk, Customer, Order, OrderLine
-from app.mod_db_manage.xml_parser import get_orders_gen, get_order_items_gen, extract_master_files_data
+from app.mod_db_manage.xml_parser import get_order, get_order_files_gen, MasterFilesScanner
 from app.mod_db_manage.config import *
-from app.mod_db_manage.utils import check_group_dirs, check_master_files_dirs, DATATYPES_NAMES
+from app.mod_db_manage.manifest import FileManifest
+from app.mod_db_manage.checkpoints import StageCheckpoints
+from app.mod_db_manage.stages import StageGraph
+from app.mod_db_manage.copy_ingest import CopyOrderWriter
+from app.mod_db_manage.pipeline import OrderPipeline
+from app.mod_db_manage.instrumentation import ingest_stats, build_summary
+from app.mod_db_manage.watcher import DataDirWatcher
+from app.mod_db_manage.utils import check_group_dirs, check_master_files_dirs, iter_batches, iter_with_next, \
+    reset_org_index, DATATYPES_NAMES
 
 
 class DBInsert:
@@ -17,10 +34,140 @@ class DBInsert:
     Inserts new data from XML files to database
     New instance is created for each valid Group directory of organization directory
     """
-    def __init__(self, org_dir, org_id):
+    def __init__(self, org_dir, org_id, full_rescan=False):
         self.org_dir = org_dir
         self.org_id = org_id
+        self.manifest = FileManifest(org_id, full_rescan=full_rescan)
+        self.new_master_files = set()
+        self.master_files = MasterFilesScanner(org_dir, file_filter=self.check_master_file,
+                                               on_error=self.quarantine_master_file)
+        self.quarantined_files = []
+
+    def check_master_file(self, filepath):
+        """
+        Filter for master files: skips files that were processed already
+        New files are remembered to be marked as processed when all master data is inserted
+
+        :param filepath: path of master file
+        :return: True if file has to be parsed
+        """
+        if self.manifest.is_new(filepath):
+            self.new_master_files.add(filepath)
+            return True
+
+        return False
+
+    def quarantine_file(self, filepath, error):
+        """
+        Mark file as failed in manifest, it is skipped by next runs until it changes
+        :param filepath: path of XML file
+        :param error: error message
+        """
+        print("Quarantined {}:\n{}".format(filepath, error))
+        self.manifest.mark(filepath, status=FILE_STATUS_FAILED)
+        self.commit()
+        self.quarantined_files.append(filepath)
+
+    def quarantine_master_file(self, filepath, error):
+        """Quarantine master file that could not be parsed, its records are not inserted"""
+        self.new_master_files.discard(filepath)
+        self.quarantine_file(filepath, error)
+
+    def master_stages(self):
+        """
+        :return: dictionary {stage name: function inserting master data of the stage},
+        dependencies of stages are defined by MASTER_STAGE_DEPENDENCIES
+        """
+        return {"fixed_totalizer": self.insert_fixed_totalizer,
+                "free_function": self.insert_free_function,
+                "group": self.insert_group,
+                "department": self.insert_departments,
+                "tax": self.insert_taxes,
+                "plu": self.insert_plu,
+                "clerk": self.insert_clerks,
+                "customer": self.insert_customers}
+
+    def run_in_thread(self, insert_stage):
+        """
+        Wrap stage to be run in a worker thread, thread uses its own session which is removed when stage is done
+        """
+        def run_stage():
+            try:
+                insert_stage()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+        return run_stage
+
+    def insert_master_data(self, then=None, max_workers=MASTER_STAGE_WORKERS):
+        """
+        Insert data of new master files, stages which do not depend on each other are run concurrently
+        Each completed stage is checkpointed, so a rerun after failure continues from the failed stage
+        (as long as the new master files did not change)
+
+        :param then: optional function (for example, inserting orders) called as soon as
+        stages listed in ORDER_STAGE_DEPENDENCIES are committed
+        :param max_workers: max number of stages running at once
+        """
+        self.master_files.scan()
 
+        if not self.new_master_files:
+            if then is not None:
+                then()
+            return
+
+        checkpoints = StageCheckpoints(self.org_id, self.new_master_files)
+        stages = {}
+
+        for stage, insert_stage in self.master_stages().items():
+            if checkpoints.is_done(stage):
+                print("Stage {} is done already, skipped".format(stage))
+                continue
+
+            stages[stage] = self.run_in_thread(insert_stage)
+
+        def on_stage_done(stage):
+            checkpoints.mark_done(stage)
+            self.commit()
+
+        StageGraph(MASTER_STAGE_DEPENDENCIES, max_workers).run(stages,
+                                                                on_done=on_stage_done,
+                                                                final_stage=then,
+                                                                final_dependencies=ORDER_STAGE_DEPENDENCIES)
+
+        # all stages are done, master files are not parsed again by next runs
+        checkpoints.clear()
+        self.mark_master_files()
+
+    def mark_master_files(self):
+        """
+        Mark new master files as processed in manifest
+        """
+        for filepath in self.new_master_files:
+            self.manifest.mark(filepath)
+
+        self.commit()
+        self.new_master_files = set()
+
+    def add_row(self, db_row):
+        """
+        Add new object to session and send it to database
+        :param db_row: model object
+        """
+        with ingest_stats.timer("insert"):
+            db.session.add(db_row)
+            db.session.flush()
+
+        ingest_stats.count("rows")
+
+    def commit(self):
+        with ingest_stats.timer("commit"):
+            db.session.commit()
+
+    @ingest_stats.timed("lookup")
     def if_duplicate_exists(self, classname, **kwargs):
         """
         Try to find an entry's duplicate in database
@@ -37,7 +184,7 @@ class DBInsert:
             return False
 
     def insert_fixed_totalizer(self):
-        fixed_totalizers = extract_master_files_data(self.org_dir, DATATYPES_NAMES["fixed_totalizer"])
+        fixed_totalizers = self.master_files.get_records(DATATYPES_NAMES["fixed_totalizer"])
 
         for ft in fixed_totalizers:
             ft_duplicate = self.if_duplicate_exists(FixedTotalizer, number=ft.number, org_id=self.org_id)
@@ -51,12 +198,12 @@ class DBInsert:
                                    org_id=self.org_id,
                                    name=ft.name
                                    )
-            db.session.add(db_ft)
-            db.session.commit()
+            self.add_row(db_ft)
+            self.commit()
             print(db_ft)
 
     def insert_free_function(self):
-        free_functions = extract_master_files_data(self.org_dir, DATATYPES_NAMES["free_function"])
+        free_functions = self.master_files.get_records(DATATYPES_NAMES["free_function"])
 
         for ff in free_functions:
             ff_duplicate = self.if_duplicate_exists(FreeFunction, number=ff.number, org_id=self.org_id)
@@ -71,12 +218,12 @@ class DBInsert:
                                  name=ff.name,
                                  function_number=ff.function_number
                                  )
-            db.session.add(db_ff)
-            db.session.commit()
+            self.add_row(db_ff)
+            self.commit()
             print(db_ff)
 
     def insert_group(self):
-        groups = extract_master_files_data(self.org_dir, DATATYPES_NAMES["group_name"])
+        groups = self.master_files.get_records(DATATYPES_NAMES["group_name"])
 
         for group in groups:
             group_duplicate = self.if_duplicate_exists(Group, number=group.number, org_id=self.org_id)
@@ -90,12 +237,12 @@ class DBInsert:
                              org_id=self.org_id,
                              name=group.name,
                              )
-            db.session.add(db_group)
-            db.session.commit()
+            self.add_row(db_group)
+            self.commit()
             print(db_group)
 
     def insert_departments(self):
-        departments = extract_master_files_data(self.org_dir, DATATYPES_NAMES["department_name"])
+        departments = self.master_files.get_records(DATATYPES_NAMES["department_name"])
 
         for dep in departments:
             dep_duplicate = self.if_duplicate_exists(Department, number=dep.number, org_id=self.org_id)
@@ -103,7 +250,8 @@ class DBInsert:
                 continue
 
             # check for group with non-existing number
-            valid_group = db.session.query(Group).filter_by(number=dep.group_number).first()
+            with ingest_stats.timer("lookup"):
+                valid_group = db.session.query(Group).filter_by(org_id=self.org_id, number=dep.group_number).first()
             if not valid_group:
                 dep.group_id = None
             else:
@@ -116,12 +264,12 @@ class DBInsert:
                                 org_id=self.org_id,
                                 name=dep.name,
                                 group_id=dep.group_id)
-            db.session.add(db_dep)
-            db.session.commit()
+            self.add_row(db_dep)
+            self.commit()
             print(db_dep)
 
     def insert_taxes(self):
-        taxes = extract_master_files_data(self.org_dir, DATATYPES_NAMES["tax_name"])
+        taxes = self.master_files.get_records(DATATYPES_NAMES["tax_name"])
 
         for tax in taxes:
             tax_duplicate = self.if_duplicate_exists(Tax, number=tax.number, org_id=self.org_id)
@@ -136,34 +284,36 @@ class DBInsert:
                          name=tax.name,
                          rate=tax.rate
                          )
-            db.session.add(db_tax)
-            db.session.commit()
+            self.add_row(db_tax)
+            self.commit()
             print(db_tax)
 
     def insert_plu(self):
         # merge PLU and PLU 2nd items together
-        plu_items = list(extract_master_files_data(self.org_dir, DATATYPES_NAMES["plu_name"]))
-        plu2nd_items = list(extract_master_files_data(self.org_dir, DATATYPES_NAMES["plu2nd_name"]))
+        plu_items = self.master_files.get_records(DATATYPES_NAMES["plu_name"])
+        plu2nd_items = self.master_files.get_records(DATATYPES_NAMES["plu2nd_name"])
 
-        for plu in plu_items + plu2nd_items:
+        for plu in itertools.chain(plu_items, plu2nd_items):
             plu_duplicate = self.if_duplicate_exists(PLU, number=plu.number, name=plu.name, org_id=self.org_id)
             if plu_duplicate:
                 continue
 
             # check for group and department with non-existing number
-            valid_group = Group.query.filter_by(number=plu.group_number).first()
+            with ingest_stats.timer("lookup"):
+                valid_group = Group.query.filter_by(org_id=self.org_id, number=plu.group_number).first()
+                valid_dep = Department.query.filter_by(org_id=self.org_id, number=plu.department_number).first()
+                valid_tax = Tax.query.filter_by(org_id=self.org_id, number=plu.tax_number).first()
+
             if not valid_group:
                 plu.group_id = None
             else:
                 plu.group_id = valid_group.id
 
-            valid_dep = Department.query.filter_by(number=plu.department_number).first()
             if not valid_dep:
                 plu.department_id = None
             else:
                 plu.department_id = valid_dep.id
 
-            valid_tax = Tax.query.filter_by(number=plu.tax_number).first()
             if not valid_tax:
                 plu.tax_id = None
             else:
@@ -180,12 +330,12 @@ class DBInsert:
                          price=plu.price,
                          tax_id=plu.tax_id,
                          )
-            db.session.add(db_plu)
-            db.session.commit()
+            self.add_row(db_plu)
+            self.commit()
             print(db_plu)
 
     def insert_clerks(self):
-        clerks = extract_master_files_data(self.org_dir, DATATYPES_NAMES["clerk_name"])
+        clerks = self.master_files.get_records(DATATYPES_NAMES["clerk_name"])
 
         for clerk in clerks:
             clerk_duplicate = self.if_duplicate_exists(Clerk, number=clerk.number, org_id=self.org_id)
@@ -199,12 +349,12 @@ class DBInsert:
                              org_id=self.org_id,
                              name=clerk.name
                              )
-            db.session.add(db_clerk)
-            db.session.commit()
+            self.add_row(db_clerk)
+            self.commit()
             print(db_clerk)
 
     def insert_customers(self):
-        customers = extract_master_files_data(self.org_dir, DATATYPES_NAMES["customer_name"])
+        customers = self.master_files.get_records(DATATYPES_NAMES["customer_name"])
 
         for customer in customers:
             customer_duplicate = self.if_duplicate_exists(Customer, number=customer.number, org_id=self.org_id)
@@ -227,10 +377,11 @@ class DBInsert:
                                    overdraft_limit=customer.overdraft_limit,
                                    custgroup_number=customer.custgroup_number
                                    )
-            db.session.add(db_customer)
-            db.session.commit()
+            self.add_row(db_customer)
+            self.commit()
             print(db_customer)
 
+    @ingest_stats.timed("lookup")
     def customize_orderline_plu(self, db_orderline, plu_number):
         """
         Customize OrderLine object with PLU details (for ItemType = 0)
@@ -239,11 +390,12 @@ class DBInsert:
 
         return db_orderline
 
+    @ingest_stats.timed("lookup")
     def customize_orderline_freefunc(self, order_item, db_orderline):
         """
         Customize OrderLine object with FreeFunction details (for ItemType = 1)
         """
-        valid_ffunc = FreeFunction.query.filter_by(number=order_item.item_number).first()
+        valid_ffunc = FreeFunction.query.filter_by(org_id=self.org_id, number=order_item.item_number).first()
 
         if not valid_ffunc:
             db_orderline.free_func_id = None
@@ -260,9 +412,11 @@ class DBInsert:
 
         return db_orderline
 
+    @ingest_stats.timed("lookup")
     def customize_orderline_fixedtotal(self, order_item, db_orderline):
         """Customize OrderLine object with FixedTotalizer details (for ItemType = 4)"""
-        db_orderline.fixed_total_id = FixedTotalizer.query.filter_by(name=order_item.name).first().id
+        fixed_totalizer = FixedTotalizer.query.filter_by(org_id=self.org_id, name=order_item.name).first()
+        db_orderline.fixed_total_id = fixed_totalizer.id
 
         return db_orderline
 
@@ -272,7 +426,7 @@ class DBInsert:
         :param db_order: Order object
         :param order_lines: order lines (items of the order)
         """
-        for ol_num, order_item in enumerate(order_lines):
+        for order_item, next_item in iter_with_next(order_lines):
             db_orderline = OrderLine()
             db_orderline.order_id = db_order.id
             db_orderline.qty = order_item.qty
@@ -280,13 +434,15 @@ class DBInsert:
             # work with VOID free functions
             # add to free function VOID
             if "VD:" in order_item.name:
-                void_free_function = FreeFunction.query.filter_by(org_id=self.org_id, name='VOID').first()
+                with ingest_stats.timer("lookup"):
+                    void_free_function = FreeFunction.query.filter_by(org_id=self.org_id, name='VOID').first()
                 db_orderline.free_func_id = void_free_function.id
 
             # work with CANCEL free functions
             # add to free function CANCEL
             elif "CL:" in order_item.name:
-                cancel_free_function = FreeFunction.query.filter_by(org_id=self.org_id, name='CANCEL').first()
+                with ingest_stats.timer("lookup"):
+                    cancel_free_function = FreeFunction.query.filter_by(org_id=self.org_id, name='CANCEL').first()
                 db_orderline.free_func_id = cancel_free_function.id
 
             db_orderline.value = order_item.value
@@ -294,84 +450,171 @@ class DBInsert:
             db_orderline.name = order_item.name
 
             # process PLU-type item
-            if order_item.item_type == str(PLU_ITEM_TYPE):
+            if order_item.item_type == PLU_ITEM_TYPE:
                 db_orderline = self.customize_orderline_plu(db_orderline, order_item.item_number)
 
             # process Free Function-type item
-            elif order_item.item_type == str(FREE_FUNC_ITEM_TYPE):
+            elif order_item.item_type == FREE_FUNC_ITEM_TYPE:
                 db_orderline = self.customize_orderline_freefunc(order_item, db_orderline)
 
                 # check if item has a change (for cash-type free functions)
-                if "CASH" in order_item.name:
+                if "CASH" in order_item.name and next_item is not None:
 
-                    if ol_num < len(order_lines) - 1:
-                        next_item = order_lines[ol_num + 1]
-
-                        if next_item.item_type == str(TEXT_ITEM_TYPE) and next_item.name == "CHANGE":
-                            db_orderline.change = next_item.value
+                    if next_item.item_type == TEXT_ITEM_TYPE and next_item.name == "CHANGE":
+                        db_orderline.change = next_item.value
 
             # process PLU 2nd-type item
-            elif order_item.item_type == str(PLU2ND_ITEM_TYPE):
+            elif order_item.item_type == PLU2ND_ITEM_TYPE:
                 db_orderline = self.customize_orderline_plu(db_orderline, order_item.item_number)
 
             # process Fixed totalizer-type item
-            elif order_item.item_type == str(FIXED_TOTAL_TYPE):
+            elif order_item.item_type == FIXED_TOTAL_TYPE:
                 db_orderline = self.customize_orderline_fixedtotal(order_item, db_orderline)
 
             else:
                 continue
 
-            db.session.add(db_orderline)
-            db.session.commit()
+            self.add_row(db_orderline)
             print(db_orderline)
 
-    def insert_order_data(self):
+    def insert_order(self, order):
         """
-        Insert orders to database
+        Add order and its order lines to current session, caller commits them
+        :param order: OrderData object
         """
-        orders = get_orders_gen(self.org_dir)
+        order_duplicate = self.if_duplicate_exists(Order,
+                                                  consecutive_number=order.consecutive_number,
+                                                  date_time=order.date_time,
+                                                  org_id=self.org_id)
+        if order_duplicate:
+            self.manifest.mark(order.filepath)
+            return
+
+        # get clerk and customer
+        with ingest_stats.timer("lookup"):
+            valid_clerk = Clerk.query.filter_by(number=order.clerk_number, org_id=self.org_id).first()
+            valid_customer = Customer.query.filter_by(
+                number=order.customer_number, org_id=self.org_id).first()
 
-        for order in orders:
-            order_duplicate = self.if_duplicate_exists(Order,
-                                                      consecutive_number=order.consecutive_number,
-                                                      date_time=order.date_time,
-                                                      org_id=self.org_id)
-            if order_duplicate:
+        if not valid_clerk:
+            clerk_id = None
+        else:
+            clerk_id = valid_clerk.id
+
+        if not valid_customer:
+            customer_id = None
+        else:
+            customer_id = valid_customer.id
+
+        db_order = Order(date_time=order.date_time,
+                         filepath=order.filepath,
+                         org_id=self.org_id,
+                         mode=order.mode,
+                         consecutive_number=order.consecutive_number,
+                         terminal_number=order.terminal_number,
+                         terminal_name=order.terminal_name,
+                         clerk_id=clerk_id,
+                         customer_id=customer_id,
+                         table_number=order.table_number
+                         )
+        self.add_row(db_order)
+        print(db_order)
+
+        # process order lines
+        self.get_order_lines(db_order, order.items)
+
+        self.manifest.mark(order.filepath)
+
+    def write_orders_safely(self, write_batch, orders):
+        """
+        Write batch of orders, if it fails, orders are written one by one and failed order files are quarantined
+        Database connection errors are raised, files are not quarantined because of them
+
+        :param write_batch: function that takes list of OrderData objects and writes them with one commit
+        :param orders: list of OrderData objects
+        """
+        try:
+            write_batch(orders)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception:
+            db.session.rollback()
+
+            if len(orders) == 1:
+                self.quarantine_file(orders[0].filepath, traceback.format_exc())
+                return
+
+            for order in orders:
+                self.write_orders_safely(write_batch, [order])
+
+    def parse_orders(self, order_files):
+        """
+        Parse order files, files that could not be parsed are quarantined
+        :param order_files: paths of order files
+        :return: OrderData object
+        """
+        for of in order_files:
+            try:
+                order = get_order(of)
+            except Exception:
+                self.quarantine_file(of, traceback.format_exc())
                 continue
 
-            # get clerk id
-            valid_clerk = Clerk.query.filter_by(number=order.clerk_number, org_id=self.org_id).first()
-            if not valid_clerk:
-                clerk_id = None
-            else:
-                clerk_id = valid_clerk.id
+            yield order
 
-            # get customer id
-            valid_customer = Customer.query.filter_by(
-                number=order.customer_number, org_id=self.org_id).first()
-            if not valid_customer:
-                customer_id = None
-            else:
-                customer_id = valid_customer.id
+    def insert_orders_batch(self, orders):
+        """
+        Insert several orders with one commit
+        :param orders: list of OrderData objects
+        """
+        for order in orders:
+            self.insert_order(order)
 
-            db_order = Order(date_time=order.date_time,
-                             filepath=order.filepath,
-                             org_id=self.org_id,
-                             mode=order.mode,
-                             consecutive_number=order.consecutive_number,
-                             terminal_number=order.terminal_number,
-                             terminal_name=order.terminal_name,
-                             clerk_id=clerk_id,
-                             customer_id=customer_id,
-                             table_number=order.table_number
-                             )
-            db.session.add(db_order)
-            db.session.commit()
-            print(db_order)
+        self.commit()
+
+    def insert_order_data(self, parse_workers=1, ingest_backend=INGEST_BACKEND, order_files=None):
+        """
+        Insert orders to database
+
+        :param parse_workers: if more than 1, order files are parsed by a pool of processes
+        and written by this process in batches (see app/mod_db_manage/pipeline.py)
+        :param ingest_backend: "orm" for row by row inserts,
+        "copy" for PostgreSQL COPY (see app/mod_db_manage/copy_ingest.py)
+        :param order_files: paths of order files to insert, all order files of organization if None
+
+        Orders are committed in batches together with manifest entries of their files,
+        so a rerun continues after the last committed batch. Broken order files are quarantined.
+        """
+        if order_files is None:
+            order_files = get_order_files_gen(self.org_dir, file_filter=self.manifest.is_new)
+        else:
+            order_files = (of for of in order_files if self.manifest.is_new(of))
+
+        order_files = ingest_stats.timed_iter(order_files, "scan")
+
+        if ingest_backend == "copy":
+            write_batch = CopyOrderWriter(self.org_id, self.manifest).write_batch
+            batch_size = COPY_BATCH_SIZE
+        else:
+            write_batch = self.insert_orders_batch
+            batch_size = ORDERS_BATCH_SIZE
+
+        def write_orders(orders):
+            self.write_orders_safely(write_batch, orders)
 
-            # process order lines
-            order_lines = list(get_order_items_gen(db_order.filepath))
-            self.get_order_lines(db_order, order_lines)
+        # daemonic processes (workers of --workers pool) are not allowed to have children
+        if parse_workers > 1 and not multiprocessing.current_process().daemon:
+            pipeline = OrderPipeline(parse_workers, batch_size=batch_size)
+            pipeline.run(order_files, write_orders, on_error=self.quarantine_file)
+            print(pipeline.report())
+
+            # orders were parsed in other processes
+            ingest_stats.add("parse", pipeline.stats["parse_time"])
+            ingest_stats.count("files", pipeline.stats["files"])
+            return
+
+        for batch in iter_batches(self.parse_orders(order_files), batch_size):
+            write_orders(batch)
 
 
 from app import session_add, session_commit
@@ -384,6 +627,158 @@ def create_admin():
     session_commit()
 
 
+def process_org(data_path, org_dir, full_rescan=False, parse_workers=1, ingest_backend=INGEST_BACKEND,
+                order_files=None, master_stages=True):
+    """
+    Insert new data of one organization directory
+
+    :param data_path: path of data storage
+    :param org_dir: name of organization directory
+    :param full_rescan: if True, files listed in processed files manifest are parsed again
+    :param parse_workers: number of processes parsing order files (see DBInsert.insert_order_data)
+    :param ingest_backend: "orm" or "copy" (see DBInsert.insert_order_data)
+    :param order_files: paths of order files to insert, all order files of organization if None
+    :param master_stages: if False, master files are not checked (only order files changed)
+    :return: dictionary with processing summary (org_dir, status, message, elapsed, stats)
+    """
+    start_time = time.time()
+    summary = {"org_dir": org_dir, "status": ORG_STATUS_SKIPPED, "message": ""}
+    print(org_dir)
+    org_data_path = os.path.join(data_path, org_dir)
+
+    try:
+        # directory tree is listed once for all checks and stages below (see OrgIndex)
+        with ingest_stats.timer("scan"):
+            reset_org_index(org_data_path)
+            has_group_dirs = check_group_dirs(org_data_path)
+
+        # check if organization directory contains any group directories
+        if not has_group_dirs:
+            summary["message"] = "This directory ({}) does not contain Group directories. Abort.".format(org_dir)
+
+        # check if organization directory has at least one Master Files directory in all group subdirectories
+        elif not check_master_files_dirs(org_data_path):
+            summary["message"] = "This directory ({}) does not contain Master Files directories. Abort.".format(org_dir)
+
+        else:
+            org_id = Organization.query.filter_by(data_dir=org_dir).with_entities(Organization.id).first()
+
+            # check if there is no existing organization for this directory
+            if not org_id:
+                summary["message"] = 'Organization with directory "{}" was not found. Abort.'.format(org_dir)
+
+            else:
+                db_insert = DBInsert(org_data_path, org_id.id, full_rescan=full_rescan)
+
+                def insert_orders():
+                    db_insert.insert_order_data(parse_workers=parse_workers, ingest_backend=ingest_backend,
+                                                order_files=order_files)
+
+                if master_stages:
+                    db_insert.insert_master_data(then=insert_orders)
+                else:
+                    insert_orders()
+
+                summary["status"] = ORG_STATUS_PROCESSED
+                summary["message"] = "Processed successfully"
+                if db_insert.quarantined_files:
+                    summary["message"] += ", {} files quarantined".format(len(db_insert.quarantined_files))
+
+    except Exception:
+        db.session.rollback()
+        summary["status"] = ORG_STATUS_ERROR
+        summary["message"] = "Processed with error:\n" + traceback.format_exc()
+
+    finally:
+        db.session.remove()
+
+    print(summary["message"])
+    summary["elapsed"] = time.time() - start_time
+    # timings and counters of this organization (see app/mod_db_manage/instrumentation.py)
+    summary["stats"] = ingest_stats.pop()
+
+    return summary
+
+
+def init_worker():
+    """
+    Initializer of worker processes
+    Connections inherited from parent process must not be shared, so each worker opens its own
+    """
+    db.engine.dispose()
+
+
+def process_org_worker(task):
+    """
+    Process organization in worker process
+    :param task: tuple (data_path, org_dir, full_rescan, parse_workers, ingest_backend)
+    :return: processing summary (see process_org)
+    """
+    return process_org(*task)
+
+
+def print_summary(summaries):
+    """
+    Print aggregated results of all processed organizations
+    :param summaries: list of summaries returned by process_org
+    """
+    statuses = [summary["status"] for summary in summaries]
+
+    print("Organizations: {} processed, {} with errors, {} skipped".format(
+        statuses.count(ORG_STATUS_PROCESSED), statuses.count(ORG_STATUS_ERROR), statuses.count(ORG_STATUS_SKIPPED)))
+
+    for summary in summaries:
+        if summary["status"] == ORG_STATUS_ERROR:
+            print("Failed: {} ({:.1f} s)".format(summary["org_dir"], summary["elapsed"]))
+
+
+def write_bench_summary(output, summaries, elapsed, args):
+    """
+    Write JSON summary of ingest run (--bench)
+
+    :param output: path of output file, "-" for standard output
+    :param summaries: list of summaries returned by process_org
+    :param elapsed: wall-clock time of the run in seconds
+    :param args: parsed command line arguments
+    """
+    statuses = [summary["status"] for summary in summaries]
+    bench_summary = build_summary([summary["stats"] for summary in summaries], elapsed,
+                                  organizations={"processed": statuses.count(ORG_STATUS_PROCESSED),
+                                                 "error": statuses.count(ORG_STATUS_ERROR),
+                                                 "skipped": statuses.count(ORG_STATUS_SKIPPED)},
+                                  workers=args.workers,
+                                  parse_workers=args.parse_workers,
+                                  ingest_backend=args.ingest_backend)
+    text = json.dumps(bench_summary, indent=2, sort_keys=True)
+
+    if output == "-":
+        print(text)
+    else:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+
+
+def watch_data_dir(watcher, data_path, args):
+    """
+    Ingest new files as soon as they are completely written (see app/mod_db_manage/watcher.py)
+
+    :param watcher: DataDirWatcher object
+    :param data_path: path of data storage
+    :param args: parsed command line arguments
+    """
+    def on_ready(org_dir, order_files, master_files, archives):
+        # new archive may contain any data files, whole organization directory is checked then
+        summary = process_org(data_path, org_dir,
+                              parse_workers=args.parse_workers,
+                              ingest_backend=args.ingest_backend,
+                              order_files=None if archives else order_files,
+                              master_stages=bool(master_files or archives))
+
+        return summary["status"] != ORG_STATUS_ERROR
+
+    watcher.watch(on_ready)
+
+
 def main():
     db.create_all()
 
@@ -391,6 +786,22 @@ def main():
     parser = argparse.ArgumentParser(description="Specify if create admin with --create_admin")
     parser.add_argument("--create_admin", action="store_true", help="If set, admin user will be created")
     parser.add_argument("--nodata", action="store_true", help="If set, no data will be added")
+    parser.add_argument("--full_rescan", "--full-rescan", action="store_true",
+                        help="If set, files already listed in processed files manifest are parsed again")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to handle organization directories in parallel")
+    parser.add_argument("--parse_workers", type=int, default=1,
+                        help="Number of processes parsing order files of organization (used if --workers is 1)")
+    parser.add_argument("--ingest_backend", choices=["orm", "copy"], default=INGEST_BACKEND,
+                        help="How orders are written: row by row ORM inserts or PostgreSQL COPY")
+    parser.add_argument("--watch", action="store_true",
+                        help="If set, keeps running after processing all directories and ingests new files")
+    parser.add_argument("--bench", nargs="?", const="-", metavar="PATH",
+                        help="If set, per-stage timings, files/s, rows/s and peak memory are written as JSON "
+                             "to PATH (standard output if PATH is not given)")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="If set, processing is run under cProfile and profile is saved to PATH "
+                             "(worker processes of --workers and --parse_workers are not profiled)")
     args = parser.parse_args()
 
     if args.create_admin:
@@ -404,47 +815,47 @@ def main():
 
     data_path = os.path.join(SCRIPT_DIR, DATA_DIR)
     org_dirs = os.listdir(data_path)
+    # files that appear while directories are processed are picked up by watcher
+    if args.watch:
+        watcher = DataDirWatcher(data_path)
 
-    # go through each directory in data storage
-    for org_dir in org_dirs:
-        print(org_dir)
-        org_data_path = os.path.join(data_path, org_dir)
+    tasks = [(data_path, org_dir, args.full_rescan, args.parse_workers, args.ingest_backend) for org_dir in org_dirs]
 
-        # check if organization directory contains any group directories
-        if not check_group_dirs(org_data_path):
-            print("This directory ({}) does not contain Group directories. Abort.".format(org_dir))
-            continue
+    ingest_stats.enabled = args.bench is not None
+    start_time = time.time()
 
-        # check if organization directory has at least one Master Files directory in all group subdirectories
-        if not check_master_files_dirs(org_data_path):
-            print("This directory ({}) does not contain Master Files directories. Abort.".format(org_dir))
-            continue
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-        org_id = Organization.query.filter_by(data_dir=org_dir).with_entities(Organization.id).first()
+    # go through each directory in data storage
+    if args.workers > 1:
+        db.session.remove()
+        db.engine.dispose()
+        pool = multiprocessing.Pool(args.workers, initializer=init_worker)
 
-        # check if there is no existing organization for this directory
-        if not org_id:
-            print('Organization with directory "{}" was not found. Abort.'.format(org_dir))
-            continue
+        try:
+            summaries = list(pool.imap_unordered(process_org_worker, tasks))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        summaries = [process_org_worker(task) for task in tasks]
 
-        db_insert = DBInsert(org_data_path, org_id)
+    elapsed = time.time() - start_time
 
-        try:
-            db_insert.insert_fixed_totalizer()
-            db_insert.insert_free_function()
-            db_insert.insert_group()
-            db_insert.insert_departments()
-            db_insert.insert_taxes()
-            db_insert.insert_plu()
-            db_insert.insert_clerks()
-            db_insert.insert_customers()
-            db_insert.insert_order_data()
-
-            print("Processed successfully")
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(30)
 
-        except Exception:
-            print("Processed with error:")
-            traceback.print_exc()
+    print_summary(summaries)
+
+    if args.bench is not None:
+        write_bench_summary(args.bench, summaries, elapsed, args)
+
+    if args.watch:
+        watch_data_dir(watcher, data_path, args)
 
 
 if __name__ == "__main__":